@@ -0,0 +1,305 @@
+"""Pre-aggregated sales rollups.
+
+Every order is counted once per stage ("placed" when created, "paid" when
+captured) into hourly and daily buckets. The buckets are kept by category,
+by product and for the whole store ("all"). Each rollup document holds
+revenue (in cents), units and order count for one (granularity, dimension,
+stage, key, bucket). A date-range report therefore reads at most
+buckets x keys small documents, however many orders there are.
+
+An order is claimed for a stage by adding the stage to its ``rollups``
+array before its increments are written. Redelivered outbox events and
+re-run backfills therefore never count it twice. If computing or writing
+the increments fails, the claim is released again so the outbox retry (or
+the next backfill) counts the order. Only a crash between the claim and the
+write, or a bulk write that fails part-way, can still miscount.
+
+    python analytics.py backfill     # roll up orders that predate this subsystem
+    python analytics.py benchmark    # time a 12-month revenue-by-category query
+"""
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("all", "category", "product")
+STAGES = ("placed", "paid")
+PAID_STATUSES = ("paid", "shipped", "delivered")
+UNCATEGORIZED = "Uncategorized"
+
+
+def _parse_datetime(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class SalesRollups:
+    def __init__(self, db, catalog, batch_size: int = 1000):
+        self.orders = db.orders
+        self.rollups = db.sales_rollups
+        self.catalog = catalog
+        self.batch_size = batch_size
+        self.backfill_status = {"running": False, "orders": 0, "started_at": None, "finished_at": None, "error": None}
+        self._backfill_task = None
+
+    async def ensure_indexes(self):
+        await self.rollups.create_index(
+            [("granularity", 1), ("dimension", 1), ("stage", 1), ("bucket", 1), ("key", 1)],
+            unique=True,
+        )
+
+    async def _claim(self, order_id: str, stage: str) -> Optional[dict]:
+        selector = {"id": order_id, "rollups": {"$ne": stage}}
+        if stage == "paid":
+            selector["status"] = {"$in": list(PAID_STATUSES)}
+        return await self.orders.find_one_and_update(
+            selector,
+            {"$addToSet": {"rollups": stage}},
+            projection={"_id": 0, "items": 1, "created_at": 1, "paid_at": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _release(self, order_ids: List[str], stage: str):
+        await self.orders.update_many({"id": {"$in": order_ids}}, {"$pull": {"rollups": stage}})
+
+    async def _increments(self, order: dict, stage: str, into: Dict[Tuple, List[int]]):
+        moment = _parse_datetime(order.get("paid_at") or order["created_at"]) if stage == "paid" else _parse_datetime(order["created_at"])
+
+        per_key = defaultdict(lambda: [0, 0])
+        for item in order.get("items", []):
+            product = await self.catalog.get(item["product_id"])
+            category = product["category"] if product else UNCATEGORIZED
+            cents = round(item["price"] * 100) * item["quantity"]
+            for dimension, key in (("all", "all"), ("category", category), ("product", item["product_id"])):
+                per_key[(dimension, key)][0] += cents
+                per_key[(dimension, key)][1] += item["quantity"]
+
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(moment, granularity)
+            for (dimension, key), (cents, units) in per_key.items():
+                totals = into[(granularity, dimension, stage, bucket, key)]
+                totals[0] += cents
+                totals[1] += units
+                totals[2] += 1
+
+    async def _write(self, increments: Dict[Tuple, List[int]]):
+        if not increments:
+            return
+        operations = [
+            UpdateOne(
+                {"granularity": granularity, "dimension": dimension, "stage": stage, "bucket": bucket, "key": key},
+                {"$inc": {"revenue_cents": cents, "units": units, "orders": orders}},
+                upsert=True,
+            )
+            for (granularity, dimension, stage, bucket, key), (cents, units, orders) in increments.items()
+        ]
+        await self.rollups.bulk_write(operations, ordered=False)
+
+    async def apply(self, order_id: str, stage: str) -> bool:
+        order = await self._claim(order_id, stage)
+        if order is None:
+            return False
+        increments = defaultdict(lambda: [0, 0, 0])
+        try:
+            await self._increments(order, stage, increments)
+            await self._write(increments)
+        except BaseException:
+            # Including cancellation at shutdown; otherwise the redelivered event would find it claimed
+            await self._release([order_id], stage)
+            raise
+        return True
+
+    def start_backfill(self) -> bool:
+        if self.backfill_status["running"]:
+            return False
+        self.backfill_status["running"] = True
+        self._backfill_task = asyncio.create_task(self._run_backfill())
+        return True
+
+    async def _run_backfill(self):
+        try:
+            await self.backfill()
+        except Exception:
+            logger.exception("Sales rollup backfill failed")
+
+    async def backfill(self) -> int:
+        """Roll up every order not yet counted, one bulk write per batch."""
+        self.backfill_status.update(running=True, orders=0, started_at=datetime.now(timezone.utc), finished_at=None, error=None)
+        try:
+            for stage in STAGES:
+                selector = {"rollups": {"$ne": stage}}
+                if stage == "paid":
+                    selector["status"] = {"$in": list(PAID_STATUSES)}
+
+                batch_ids = []
+                async for order in self.orders.find(selector, {"_id": 0, "id": 1}).batch_size(self.batch_size):
+                    batch_ids.append(order["id"])
+                    if len(batch_ids) >= self.batch_size:
+                        await self._backfill_batch(batch_ids, stage)
+                        batch_ids = []
+                await self._backfill_batch(batch_ids, stage)
+        except Exception as e:
+            self.backfill_status["error"] = str(e)
+            raise
+        finally:
+            self.backfill_status.update(running=False, finished_at=datetime.now(timezone.utc))
+        logger.info("Sales rollup backfill counted %d order stages", self.backfill_status["orders"])
+        return self.backfill_status["orders"]
+
+    async def _backfill_batch(self, order_ids: List[str], stage: str):
+        increments = defaultdict(lambda: [0, 0, 0])
+        claimed = []
+        try:
+            for order_id in order_ids:
+                # Claimed one by one so live outbox events for the same orders can't double count
+                order = await self._claim(order_id, stage)
+                if order is not None:
+                    claimed.append(order_id)
+                    await self._increments(order, stage, increments)
+            await self._write(increments)
+        except BaseException:
+            if claimed:
+                await self._release(claimed, stage)
+            raise
+        self.backfill_status["orders"] += len(claimed)
+
+    async def query(self, start: datetime, end: datetime, granularity: str = "day", dimension: str = "category", stage: str = "paid", series: bool = False) -> List[dict]:
+        group_id = {"key": "$key", "bucket": "$bucket"} if series else "$key"
+        pipeline = [
+            {"$match": {
+                "granularity": granularity,
+                "dimension": dimension,
+                "stage": stage,
+                "bucket": {"$gte": start, "$lt": end},
+            }},
+            {"$group": {
+                "_id": group_id,
+                "revenue_cents": {"$sum": "$revenue_cents"},
+                "units": {"$sum": "$units"},
+                "orders": {"$sum": "$orders"},
+            }},
+            {"$sort": {"_id": 1}},
+        ]
+        rows = []
+        async for row in self.rollups.aggregate(pipeline):
+            key = row["_id"]
+            rows.append({
+                **({"key": key["key"], "bucket": key["bucket"]} if series else {"key": key}),
+                "revenue": row["revenue_cents"] / 100,
+                "units": row["units"],
+                "orders": row["orders"],
+            })
+        return rows
+
+
+async def _benchmark(db, total_orders: int = 10_000_000, runs: int = 50, days: int = 365):
+    """Time a ``days``-long revenue-by-category query over rollups sized for ``total_orders``.
+
+    Rollup volume depends on buckets x keys, not on order count. The benchmark
+    therefore writes the hourly and daily documents a year of ``total_orders``
+    orders across the seeded categories would produce, then times the query.
+    """
+    categories = ["Educational", "Outdoor", "Puzzles", "Dolls", "Building Blocks", "Action Figures"]
+    await db.sales_rollups.drop()
+    rollups = SalesRollups(db, catalog=None)
+    await rollups.ensure_indexes()
+
+    end = bucket_start(datetime.now(timezone.utc), "day")
+    start = end - timedelta(days=days)
+    hours = days * 24
+    per_hour = total_orders / hours / len(categories)
+    batch = []
+    for hour in range(hours):
+        bucket = start + timedelta(hours=hour)
+        for category in categories:
+            orders = max(0, round(random.gauss(per_hour, per_hour / 5)))
+            for granularity in GRANULARITIES:
+                batch.append({
+                    "granularity": granularity,
+                    "dimension": "category",
+                    "stage": "paid",
+                    "bucket": bucket_start(bucket, granularity),
+                    "key": category,
+                    "revenue_cents": orders * 2500,
+                    "units": orders * 2,
+                    "orders": orders,
+                })
+        if len(batch) >= 10000:
+            await _insert_merged(db, batch)
+            batch = []
+    await _insert_merged(db, batch)
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = await rollups.query(start, end, "day", "category", "paid")
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"{sum(row['orders'] for row in rows):,} orders in {len(rows)} categories; "
+          f"p50 {statistics.median(timings):.2f} ms, p95 {timings[int(runs * 0.95) - 1]:.2f} ms")
+    await db.sales_rollups.drop()
+
+
+async def _insert_merged(db, docs):
+    # Daily documents appear once per hour in the generated stream; fold them together
+    merged = {}
+    for doc in docs:
+        key = (doc["granularity"], doc["bucket"], doc["key"])
+        if key in merged:
+            for field in ("revenue_cents", "units", "orders"):
+                merged[key][field] += doc[field]
+        else:
+            merged[key] = dict(doc)
+    await db.sales_rollups.bulk_write([
+        UpdateOne(
+            {field: doc[field] for field in ("granularity", "dimension", "stage", "bucket", "key")},
+            {"$inc": {field: doc[field] for field in ("revenue_cents", "units", "orders")}},
+            upsert=True,
+        )
+        for doc in merged.values()
+    ], ordered=False)
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from catalog import CatalogCache
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            if command == "benchmark":
+                await _benchmark(client[os.environ['DB_NAME'] + "_analytics_benchmark"])
+            else:
+                db = client[os.environ['DB_NAME']]
+                rollups = SalesRollups(db, CatalogCache(db))
+                await rollups.ensure_indexes()
+                await rollups.backfill()
+        finally:
+            client.close()
+
+    asyncio.run(main())
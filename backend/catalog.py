@@ -0,0 +1,83 @@
+"""In-process cache of the product catalog and categories.
+
+The catalog is small (the listing endpoint already caps it at 1000 products),
+so each worker keeps the whole thing in memory and refreshes it every
+``ttl_seconds``. Writes made through this worker call ``invalidate()``;
+writes made by other workers show up within one TTL.
+
+``price_version`` is a hash of every (id, price) pair, so anything priced
+against the catalog (carts) can tell cheaply whether its prices are current.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def parse_product(product: dict) -> dict:
+    if isinstance(product.get('created_at'), str):
+        product['created_at'] = datetime.fromisoformat(product['created_at'])
+    return product
+
+
+def to_cents(price: float) -> int:
+    return round(price * 100)
+
+
+def compute_price_version(products: List[dict]) -> str:
+    digest = hashlib.sha1()
+    for product_id, cents in sorted((product["id"], to_cents(product["price"])) for product in products):
+        digest.update(f"{product_id}:{cents};".encode())
+    return digest.hexdigest()[:16]
+
+
+class CatalogCache:
+    def __init__(self, db, ttl_seconds: float = 30.0):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self._products: List[dict] = []
+        self._by_id: Dict[str, dict] = {}
+        self._categories: List[dict] = []
+        self._price_version = compute_price_version([])
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        products = await self.db.products.find({}, {"_id": 0}).to_list(1000)
+        categories = await self.db.categories.find({}, {"_id": 0}).to_list(100)
+        self._products = [parse_product(product) for product in products]
+        self._by_id = {product["id"]: product for product in self._products}
+        self._categories = categories
+        self._price_version = compute_price_version(self._products)
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def _ensure_fresh(self):
+        if self.is_fresh():
+            return
+        # Concurrent misses share one reload
+        async with self._lock:
+            if not self.is_fresh():
+                await self.refresh()
+
+    async def products(self) -> List[dict]:
+        await self._ensure_fresh()
+        return self._products
+
+    async def get(self, product_id: str) -> Optional[dict]:
+        await self._ensure_fresh()
+        return self._by_id.get(product_id)
+
+    async def categories(self) -> List[dict]:
+        await self._ensure_fresh()
+        return self._categories
+
+    async def price_version(self) -> str:
+        await self._ensure_fresh()
+        return self._price_version
@@ -0,0 +1,59 @@
+"""Idempotency-key store backed by a Mongo collection with a TTL index.
+
+A request reserves ``(user_id, scope, key)`` before doing any work. Retries
+that arrive while the first attempt is running are rejected, and retries
+after it completed get the stored response back without redoing the work.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl_seconds: int = 24 * 60 * 60, lock_seconds: int = 60):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.lock = timedelta(seconds=lock_seconds)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("scope", 1), ("key", 1)], unique=True)
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def begin(self, user_id: str, scope: str, key: str) -> Optional[dict]:
+        """Reserve the key; returns the cached response if the request already completed."""
+        now = datetime.now(timezone.utc)
+        selector = {"user_id": user_id, "scope": scope, "key": key}
+        try:
+            await self.collection.insert_one({**selector, "status": "in_progress", "locked_until": now + self.lock, "created_at": now})
+            return None
+        except DuplicateKeyError:
+            pass
+
+        record = await self.collection.find_one(selector, {"_id": 0})
+        if record and record["status"] == "completed":
+            return record["response"]
+
+        # Take over a reservation left behind by a crashed request
+        taken = await self.collection.find_one_and_update(
+            {**selector, "status": "in_progress", "locked_until": {"$lte": now}},
+            {"$set": {"locked_until": now + self.lock}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is None:
+            raise IdempotencyConflict(f"A request with idempotency key {key!r} is already in progress")
+        return None
+
+    async def complete(self, user_id: str, scope: str, key: str, response: dict):
+        await self.collection.update_one(
+            {"user_id": user_id, "scope": scope, "key": key},
+            {"$set": {"status": "completed", "response": response}, "$unset": {"locked_until": ""}},
+        )
+
+    async def release(self, user_id: str, scope: str, key: str):
+        await self.collection.delete_one({"user_id": user_id, "scope": scope, "key": key, "status": "in_progress"})
@@ -0,0 +1,210 @@
+"""Resizing image proxy with a size-bounded on-disk LRU cache.
+
+Each origin image is downloaded once and kept on disk as the ``original``
+variant. Width/format variants are derived from that local copy with
+Pillow in a worker thread. Concurrent misses for the same file share one
+in-flight task, so a burst of requests for a cold image causes a single
+origin fetch and a single resize.
+
+The directory is shared by every worker, so the directory itself is the
+cache index. A hit is a ``stat`` of the file, and hits refresh its mtime
+(at most every ``TOUCH_SECONDS``). After each write, the whole directory is
+held to ``max_bytes`` by deleting the least recently touched files. Files
+touched within ``EVICT_GRACE_SECONDS`` are never deleted, so a path that
+was just found cannot vanish before it is served.
+
+Image URLs are catalog data that users can edit, so only ``allowed_hosts``
+(``host`` or ``host:port``) are fetched. Redirects are refused, and a
+download stops at ``max_source_bytes``.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Requested widths are rounded up to one of these so the number of variants stays bounded
+WIDTHS = (160, 320, 480, 800, 1200)
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+TOUCH_SECONDS = 30
+EVICT_GRACE_SECONDS = 2 * TOUCH_SECONDS
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+def snap_width(width: Optional[int]) -> Optional[int]:
+    if width is None:
+        return None
+    for candidate in WIDTHS:
+        if width <= candidate:
+            return candidate
+    return WIDTHS[-1]
+
+
+def _render(original: Path, destination: Path, width: Optional[int], pil_format: str):
+    with Image.open(original) as image:
+        if width is not None and image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, quality=80, optimize=True)
+    # Per-process temporary name: another worker may be rendering the same variant
+    temporary = destination.with_name(f"{destination.name}.{os.getpid()}.tmp")
+    temporary.write_bytes(buffer.getvalue())
+    os.replace(temporary, destination)
+
+
+class ImageCache:
+    def __init__(self, directory: Path, max_bytes: int, allowed_hosts: Iterable[str] = (),
+                 max_source_bytes: int = 20 * 1024 * 1024, timeout: float = 10.0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.max_source_bytes = max_source_bytes
+        self.timeout = timeout
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._evict()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def allows(self, source_url: str) -> bool:
+        try:
+            url = httpx.URL(source_url)
+        except httpx.InvalidURL:
+            return False
+        if url.scheme not in ("http", "https") or not url.host:
+            return False
+        origin = url.host if url.port is None else f"{url.host}:{url.port}"
+        return origin.lower() in self.allowed_hosts
+
+    async def get(self, source_url: str, width: Optional[int], fmt: str) -> Tuple[Path, str]:
+        if not self.allows(source_url):
+            raise ImageFetchError(f"Image origin not allowed: {source_url}")
+        pil_format, media_type = FORMATS[fmt]
+        width = snap_width(width)
+        name = f"{hashlib.sha256(source_url.encode()).hexdigest()}-{width or 'full'}.{fmt}"
+        path = await self._file(name, lambda: self._render_variant(source_url, name, width, pil_format))
+        return path, media_type
+
+    async def _file(self, name: str, produce) -> Path:
+        path = self.directory / name
+        if self._hit(path):
+            return path
+
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.create_task(produce())
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        # Shielded so a client that disconnects doesn't cancel the fetch for everyone else
+        await asyncio.shield(task)
+        return path
+
+    async def _original(self, source_url: str) -> Path:
+        name = f"{hashlib.sha256(source_url.encode()).hexdigest()}.original"
+        return await self._file(name, lambda: self._fetch(source_url, name))
+
+    async def _fetch(self, source_url: str, name: str):
+        if self._client is None:
+            # A redirect could point anywhere, including hosts that are not allowed
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=False)
+        content = bytearray()
+        try:
+            async with self._client.stream("GET", source_url) as response:
+                if response.is_redirect:
+                    raise ImageFetchError(f"Origin redirected {source_url}; redirects are not followed")
+                response.raise_for_status()
+                if int(response.headers.get("content-length") or 0) > self.max_source_bytes:
+                    raise ImageFetchError(f"{source_url} is larger than {self.max_source_bytes} bytes")
+                async for chunk in response.aiter_bytes():
+                    content += chunk
+                    if len(content) > self.max_source_bytes:
+                        raise ImageFetchError(f"{source_url} is larger than {self.max_source_bytes} bytes")
+        except httpx.HTTPError as e:
+            raise ImageFetchError(f"Could not fetch {source_url}: {e}") from e
+
+        path = self.directory / name
+        temporary = path.with_name(f"{name}.{os.getpid()}.tmp")
+        await asyncio.to_thread(temporary.write_bytes, bytes(content))
+        os.replace(temporary, path)
+        await asyncio.to_thread(self._evict)
+
+    async def _render_variant(self, source_url: str, name: str, width: Optional[int], pil_format: str):
+        original = await self._original(source_url)
+        path = self.directory / name
+        try:
+            try:
+                await asyncio.to_thread(_render, original, path, width, pil_format)
+            except FileNotFoundError:
+                # Another worker evicted the original between fetch and resize; fetch it again
+                original = await self._original(source_url)
+                await asyncio.to_thread(_render, original, path, width, pil_format)
+        except (OSError, Image.DecompressionBombError) as e:
+            # A bomb is a few KB of PNG claiming billions of pixels; Pillow refuses it before decoding
+            raise ImageFetchError(f"Could not decode image from {source_url}: {e}") from e
+        await asyncio.to_thread(self._evict)
+
+    @staticmethod
+    def _hit(path: Path) -> bool:
+        try:
+            modified = path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - modified > TOUCH_SECONDS:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def _scan(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((entry.name, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        files = self._scan()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        # Recently touched files stay, so the directory can briefly run over max_bytes
+        cutoff = time.time() - EVICT_GRACE_SECONDS
+        for name, size, modified in sorted(files, key=lambda file: file[2]):
+            if total <= self.max_bytes or modified > cutoff:
+                break
+            try:
+                (self.directory / name).unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
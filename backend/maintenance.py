@@ -0,0 +1,168 @@
+"""Housekeeping for carts and wishlists.
+
+Abandoned carts expire through a TTL index on ``updated_at``. The compaction
+job removes whatever the TTL index can't see: empty documents, line items
+that point at deleted products, and legacy carts whose ``updated_at`` is an
+ISO string rather than a BSON date.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+
+import bson
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Server error codes for "index already exists with different options"
+INDEX_OPTIONS_CONFLICT = (85, 86)
+
+
+async def ensure_ttl_index(collection, field: str, expire_after_seconds: int):
+    try:
+        await collection.create_index(field, expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        if e.code not in INDEX_OPTIONS_CONFLICT:
+            raise
+        # The retention setting changed since the index was built
+        await collection.database.command({
+            "collMod": collection.name,
+            "index": {"keyPattern": {field: 1}, "expireAfterSeconds": expire_after_seconds},
+        })
+
+
+def _cart_product_id(item):
+    return item["product_id"]
+
+
+def _wishlist_product_id(item):
+    return item
+
+
+def _merge_cart_items(docs):
+    quantities = {}
+    for doc in docs:
+        for item in doc.get("items", []):
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()]
+
+
+def _merge_wishlist_items(docs):
+    return list(dict.fromkeys(item for doc in docs for item in doc.get("items", [])))
+
+
+async def _merge_duplicates(collection, merge_items) -> int:
+    """Fold documents sharing a user_id into the oldest one; returns how many were removed."""
+    pipeline = [
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    async for group in collection.aggregate(pipeline):
+        docs = await collection.find({"_id": {"$in": group["ids"]}}).sort("_id", 1).to_list(None)
+        keeper, duplicates = docs[0], docs[1:]
+        # Carts lose their price snapshots here, so the next read prices them again
+        await collection.replace_one({"_id": keeper["_id"]}, {
+            "user_id": keeper["user_id"],
+            "items": merge_items(docs),
+            **({"updated_at": max(doc["updated_at"] for doc in docs)} if all("updated_at" in doc for doc in docs) else {}),
+        })
+        result = await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in duplicates]}})
+        removed += result.deleted_count
+    return removed
+
+
+async def ensure_unique_user_index(collection, merge_items):
+    """Create the unique user_id index, merging duplicates left by the old racy create-on-read."""
+    for index in (await collection.index_information()).values():
+        if index["key"] == [("user_id", 1)] and index.get("unique"):
+            return
+    removed = await _merge_duplicates(collection, merge_items)
+    if removed:
+        logger.warning("Merged %d duplicate %s documents before adding the unique user_id index", removed, collection.name)
+    await collection.create_index("user_id", unique=True)
+
+
+async def ensure_user_indexes(db):
+    await ensure_unique_user_index(db.carts, _merge_cart_items)
+    await ensure_unique_user_index(db.wishlists, _merge_wishlist_items)
+
+
+async def _compact_collection(collection, product_ids: set, item_key, pull_filter, cutoff=None, on_pull=None) -> dict:
+    report = {"deleted": 0, "items_removed": 0, "bytes_reclaimed": 0}
+
+    async for doc in collection.find({}):
+        size = len(bson.encode(doc))
+        items = doc.get("items", [])
+        dangling = sorted({item_key(item) for item in items} - product_ids)
+        updated_at = doc.get("updated_at")
+
+        if cutoff is not None and isinstance(updated_at, str):
+            if datetime.fromisoformat(updated_at) < cutoff:
+                result = await collection.delete_one({"_id": doc["_id"], "updated_at": updated_at})
+                if result.deleted_count:
+                    report["deleted"] += 1
+                    report["bytes_reclaimed"] += size
+                continue
+            # Convert to a BSON date so the TTL index takes over from here
+            await collection.update_one({"_id": doc["_id"], "updated_at": updated_at}, {"$set": {"updated_at": datetime.fromisoformat(updated_at)}})
+
+        if dangling:
+            await collection.update_one({"_id": doc["_id"]}, {"$pull": {"items": pull_filter(dangling)}, **(on_pull or {})})
+            kept = [item for item in items if item_key(item) not in dangling]
+            report["items_removed"] += len(items) - len(kept)
+            report["bytes_reclaimed"] += size - len(bson.encode({**doc, "items": kept}))
+            items = kept
+            size = len(bson.encode({**doc, "items": kept}))
+
+        if not items:
+            # Re-checked on the server in case the user added something meanwhile
+            result = await collection.delete_one({"_id": doc["_id"], "items.0": {"$exists": False}})
+            if result.deleted_count:
+                report["deleted"] += 1
+                report["bytes_reclaimed"] += size
+
+    return report
+
+
+async def compact_carts_and_wishlists(db, retention_days: int) -> dict:
+    product_ids = set(await db.products.distinct("id"))
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+    carts = await _compact_collection(
+        db.carts, product_ids, _cart_product_id,
+        lambda dangling: {"product_id": {"$in": dangling}},
+        cutoff=cutoff,
+        # The stored subtotal still counts the pulled lines; make the next read reprice the cart
+        on_pull={"$unset": {"pricing.price_version": ""}},
+    )
+    wishlists = await _compact_collection(
+        db.wishlists, product_ids, _wishlist_product_id,
+        lambda dangling: {"$in": dangling},
+    )
+    report = {
+        "carts": carts,
+        "wishlists": wishlists,
+        "bytes_reclaimed": carts["bytes_reclaimed"] + wishlists["bytes_reclaimed"],
+    }
+    logger.info("Compaction finished: %s", report)
+    return report
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            await compact_carts_and_wishlists(client[os.environ['DB_NAME']], int(os.environ.get('CART_RETENTION_DAYS', '30')))
+        finally:
+            client.close()
+
+    asyncio.run(main())
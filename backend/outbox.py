@@ -0,0 +1,248 @@
+"""Transactional outbox for order side effects.
+
+Events are embedded in the owning document's ``outbox`` array, so they are
+written by the same single-document operation that changes the order. A pool
+of in-process workers claims events with a lease, runs the registered handler
+and removes the event on success (at-least-once delivery). Failures are retried
+with exponential backoff and moved to a dead-letter collection once
+``max_attempts`` is reached.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+def new_event(event_type: str, payload: dict) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo hands back naive UTC datetimes unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class OutboxMetrics:
+    def __init__(self, window_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.in_flight = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self._completions = deque()
+
+    def record_success(self, lag_seconds: float):
+        self.processed += 1
+        self.last_lag_seconds = lag_seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+        now = time.monotonic()
+        self._completions.append(now)
+        self._trim(now)
+
+    def throughput(self) -> float:
+        now = time.monotonic()
+        self._trim(now)
+        return len(self._completions) / self.window_seconds
+
+    def _trim(self, now: float):
+        while self._completions and now - self._completions[0] > self.window_seconds:
+            self._completions.popleft()
+
+    def snapshot(self) -> dict:
+        return {
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "in_flight": self.in_flight,
+            "throughput_per_second": round(self.throughput(), 3),
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+        }
+
+
+class OutboxWorkerPool:
+    def __init__(
+        self,
+        collection,
+        dead_letter_collection,
+        workers: int = 4,
+        max_attempts: int = 8,
+        lease_seconds: float = 30.0,
+        poll_interval: float = 1.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 300.0,
+    ):
+        self.collection = collection
+        self.dead_letter_collection = dead_letter_collection
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease_seconds)
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = OutboxMetrics()
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def register(self, event_type: str, handler: Handler):
+        self._handlers[event_type] = handler
+
+    def handler(self, event_type: str):
+        def decorator(func: Handler) -> Handler:
+            self.register(event_type, func)
+            return func
+        return decorator
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("outbox.status", 1), ("outbox.next_attempt_at", 1)])
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+
+    def notify(self):
+        """Wake idle workers so freshly written events skip the poll delay."""
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        self._wakeup.set()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self) -> int:
+        """Process claimable events inline until none are left; returns the count."""
+        processed = 0
+        while await self._process_one():
+            processed += 1
+        return processed
+
+    async def backlog(self) -> dict:
+        pipeline = [
+            {"$match": {"outbox.0": {"$exists": True}}},
+            {"$project": {"n": {"$size": "$outbox"}, "oldest": {"$min": "$outbox.created_at"}}},
+            {"$group": {"_id": None, "pending": {"$sum": "$n"}, "oldest": {"$min": "$oldest"}}},
+        ]
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        if not result:
+            return {"pending": 0, "lag_seconds": 0.0}
+        oldest = result[0]["oldest"]
+        lag = (datetime.now(timezone.utc) - _as_utc(oldest)).total_seconds() if oldest else 0.0
+        return {"pending": result[0]["pending"], "lag_seconds": round(lag, 3)}
+
+    async def _run(self, worker_id: int):
+        while not self._stopping:
+            try:
+                if await self._process_one():
+                    continue
+            except Exception:
+                logger.exception("Outbox worker %s failed to process an event", worker_id)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+        doc = await self.collection.find_one_and_update(
+            {"outbox": {"$elemMatch": {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "processing", "locked_until": {"$lte": now}},
+            ]}}},
+            {
+                "$set": {
+                    "outbox.$.status": "processing",
+                    "outbox.$.claim": token,
+                    "outbox.$.locked_until": now + self.lease,
+                },
+                "$inc": {"outbox.$.attempts": 1},
+            },
+            projection={"_id": 0, "id": 1, "outbox": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not doc:
+            return None
+        for event in doc["outbox"]:
+            if event.get("claim") == token:
+                return {**event, "aggregate_id": doc["id"]}
+        return None
+
+    async def _process_one(self) -> bool:
+        event = await self._claim()
+        if event is None:
+            return False
+
+        self.metrics.in_flight += 1
+        try:
+            handler = self._handlers.get(event["type"])
+            if handler is not None:
+                await handler(event)
+        except Exception as e:
+            await self._fail(event, e)
+        else:
+            await self.collection.update_one(
+                {"id": event["aggregate_id"]},
+                {"$pull": {"outbox": {"id": event["id"], "claim": event["claim"]}}},
+            )
+            lag = (datetime.now(timezone.utc) - _as_utc(event["created_at"])).total_seconds()
+            self.metrics.record_success(lag)
+        finally:
+            self.metrics.in_flight -= 1
+        return True
+
+    async def _fail(self, event: dict, error: Exception):
+        now = datetime.now(timezone.utc)
+        selector = {"id": event["aggregate_id"], "outbox": {"$elemMatch": {"id": event["id"], "claim": event["claim"]}}}
+
+        if event["attempts"] >= self.max_attempts:
+            logger.error("Outbox event %s (%s) dead-lettered: %s", event["id"], event["type"], error)
+            dead = {k: v for k, v in event.items() if k not in ("claim", "locked_until")}
+            await self.dead_letter_collection.insert_one({**dead, "status": "dead", "last_error": str(error), "failed_at": now})
+            await self.collection.update_one(selector, {"$pull": {"outbox": {"id": event["id"]}}})
+            self.metrics.dead_lettered += 1
+            return
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (event["attempts"] - 1))
+        delay *= random.uniform(0.5, 1.0)
+        logger.warning("Outbox event %s (%s) failed, retrying in %.1fs: %s", event["id"], event["type"], delay, error)
+        await self.collection.update_one(
+            selector,
+            {"$set": {
+                "outbox.$.status": "pending",
+                "outbox.$.next_attempt_at": now + timedelta(seconds=delay),
+                "outbox.$.last_error": str(error),
+            }},
+        )
+        self.metrics.retried += 1
@@ -0,0 +1,116 @@
+"""Write-behind product view/cart/wishlist counters with decayed popularity.
+
+Hot paths only bump an in-memory dict. A background task swaps the dict out
+every ``flush_interval`` seconds and writes the coalesced increments with one
+unordered ``bulk_write``, so a crash loses at most one interval of counts.
+
+Popularity decays exponentially with ``half_life_hours``. Each product stores
+its score together with ``popularity_at``, the time the score was last
+brought up to date. A flush decays the stored score to the flush time and
+adds the new events in the same update pipeline, and ``score()`` decays it to
+the time of reading. Exponents are never positive, so nothing can overflow,
+and changing the half-life only changes how fast scores fade from then on.
+Scores written before ``popularity_at`` existed grew from ``LEGACY_EPOCH``
+and are rebased from there on their next flush.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+LEGACY_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()
+WEIGHTS = {"views": 1.0, "cart_adds": 5.0, "wishlist_adds": 3.0}
+
+
+class PopularityCounters:
+    def __init__(self, products_collection, flush_interval: float = 10.0, half_life_hours: float = 72.0):
+        if not half_life_hours > 0:
+            raise ValueError(f"half_life_hours must be positive, got {half_life_hours}")
+        self.products = products_collection
+        self.flush_interval = flush_interval
+        self.half_life_seconds = half_life_hours * 3600
+        self.flushed = 0
+        self._pending: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+        # Pending popularity is held as of this time
+        self._pending_at = time.time()
+        self._task = None
+
+    def _decay(self, since: float, until: float) -> float:
+        return 2 ** ((since - until) / self.half_life_seconds)
+
+    def record(self, product_id: str, kind: str):
+        counts = self._pending[product_id]
+        counts[kind] += 1
+        # Events after _pending_at grow slightly; the flush decays the whole batch back down
+        counts["popularity"] += WEIGHTS[kind] / self._decay(self._pending_at, time.time())
+
+    def score(self, product: dict, now: Optional[float] = None) -> float:
+        """A product's popularity decayed to ``now``."""
+        at = product.get("popularity_at", LEGACY_EPOCH)
+        return product.get("popularity", 0) * self._decay(at, time.time() if now is None else now)
+
+    def _update(self, counts: Dict[str, float], now: float) -> list:
+        counters = {
+            field: {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+            for field, value in counts.items() if field != "popularity"
+        }
+        return [{"$set": {
+            **counters,
+            "popularity": {"$add": [
+                {"$multiply": [
+                    {"$ifNull": ["$popularity", 0]},
+                    {"$pow": [2, {"$divide": [
+                        {"$subtract": [{"$ifNull": ["$popularity_at", LEGACY_EPOCH]}, now]},
+                        self.half_life_seconds,
+                    ]}]},
+                ]},
+                counts.get("popularity", 0),
+            ]},
+            "popularity_at": now,
+        }}]
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        now = time.time()
+        pending, pending_at = self._pending, self._pending_at
+        self._pending, self._pending_at = defaultdict(lambda: defaultdict(int)), now
+        decay = self._decay(pending_at, now)
+        for counts in pending.values():
+            counts["popularity"] *= decay
+        operations = [UpdateOne({"id": product_id}, self._update(counts, now)) for product_id, counts in pending.items()]
+        try:
+            await self.products.bulk_write(operations, ordered=False)
+        except Exception:
+            # Put the counts back so the next flush retries them; the popularity is already as of now
+            for product_id, counts in pending.items():
+                for field, value in counts.items():
+                    self._pending[product_id][field] += value
+            raise
+        self.flushed += len(operations)
+        return len(operations)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush popularity counters")
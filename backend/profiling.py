@@ -0,0 +1,130 @@
+"""Opt-in per-request CPU profiling.
+
+A request is profiled when it carries ``X-Profile-Token`` matching the
+configured token, or when it wins a ``sample_rate`` coin toss. Profiled
+requests run under pyinstrument's statistical sampler, which is scoped to
+the request's async context so concurrent requests don't bleed into each
+other. The slowest ``capacity`` profiles are kept as speedscope JSON, ready
+to drop into https://www.speedscope.app.
+
+With no token and a zero sample rate the middleware is a single attribute
+check per request, and pyinstrument is not even imported until the first
+profiled request.
+"""
+import heapq
+import hmac
+import itertools
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HEADER = b"x-profile-token"
+
+
+class ProfileStore:
+    """Keeps the ``capacity`` slowest profiles in a min-heap keyed on duration."""
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = capacity
+        self.recorded = 0
+        self._heap = []
+        self._by_id = {}
+        self._counter = itertools.count()
+
+    def admits(self, duration_ms: float) -> bool:
+        return len(self._heap) < self.capacity or duration_ms > self._heap[0][0]
+
+    def add(self, summary: dict, speedscope: str):
+        self.recorded += 1
+        if not self.admits(summary["duration_ms"]):
+            return
+        entry = (summary["duration_ms"], next(self._counter), summary["id"])
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, entry)
+        else:
+            _, _, evicted = heapq.heapreplace(self._heap, entry)
+            self._by_id.pop(evicted, None)
+        self._by_id[summary["id"]] = (summary, speedscope)
+
+    def list(self) -> List[dict]:
+        return sorted((summary for summary, _ in self._by_id.values()), key=lambda summary: summary["duration_ms"], reverse=True)
+
+    def get(self, profile_id: str) -> Optional[str]:
+        entry = self._by_id.get(profile_id)
+        return entry[1] if entry else None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, store: ProfileStore, token: str = "", sample_rate: float = 0.0, interval: float = 0.001):
+        self.app = app
+        self.store = store
+        self.token = token.encode()
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.enabled = bool(token) or sample_rate > 0
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed; request profiling disabled")
+            self.enabled = False
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            # Rendering is the expensive part, so skip it for profiles that wouldn't be kept
+            if self.store.admits(duration_ms):
+                self._record(profiler, profile_id, scope, status.get("code"), duration_ms)
+            else:
+                self.store.recorded += 1
+
+    def _wanted(self, scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == TOKEN_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _record(self, profiler, profile_id: str, scope, status_code: Optional[int], duration_ms: float):
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        try:
+            speedscope = profiler.output(renderer=SpeedscopeRenderer())
+        except Exception:
+            logger.exception("Failed to render profile for %s", scope["path"])
+            return
+        self.store.add({
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope["query_string"].decode("latin-1"),
+            "status": status_code,
+            "duration_ms": duration_ms,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }, speedscope)
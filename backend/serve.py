@@ -0,0 +1,48 @@
+"""Multi-worker launcher for the API.
+
+    python serve.py --workers 4 --port 8001
+
+Each worker builds its own app through server.create_app(), warms its Mongo
+pool, indexes and catalog cache in the lifespan handler and only then starts
+accepting connections. On SIGTERM uvicorn stops accepting, waits up to
+--graceful-timeout seconds for in-flight requests and then runs the lifespan
+shutdown, which drains the outbox workers.
+"""
+import argparse
+import importlib.util
+import os
+from pathlib import Path
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with multiple worker processes")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="seconds to drain in-flight requests on shutdown")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # uvloop and httptools are C speedups; fall back to the pure-Python stack when absent
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        app_dir=str(Path(__file__).parent),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
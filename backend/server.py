@@ -1,8 +1,17 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -10,40 +19,89 @@ from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from functools import lru_cache
 import json
-from paypalcheckoutsdk.core import PayPalHttpClient, SandboxEnvironment
-from paypalcheckoutsdk.orders import OrdersCreateRequest, OrdersCaptureRequest
+from outbox import OutboxWorkerPool, new_event
+from idempotency import IdempotencyStore, IdempotencyConflict
+from maintenance import ensure_ttl_index, ensure_user_indexes, compact_carts_and_wishlists
+from catalog import CatalogCache, to_cents
+from recommendations import RecommendationEngine
+from analytics import SalesRollups, GRANULARITIES, DIMENSIONS, STAGES
+from images import ImageCache, ImageFetchError, FORMATS as IMAGE_FORMATS
+from product_stream import ProductEventHub, DELTA_FIELDS
+from popularity import PopularityCounters
+from profiling import ProfileStore, ProfilingMiddleware
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, opened per worker in lifespan()
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
+# passlib/bcrypt, jose and the PayPal SDK are imported on first use, keeping them off the cold start path
 # JWT settings
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# PayPal client setup
+# PayPal client setup, built by the first payment request
 paypal_client_id = os.environ.get('PAYPAL_CLIENT_ID', '')
 paypal_secret = os.environ.get('PAYPAL_SECRET', '')
-if paypal_client_id and paypal_secret:
-    environment = SandboxEnvironment(client_id=paypal_client_id, client_secret=paypal_secret)
-    paypal_client = PayPalHttpClient(environment)
-else:
-    paypal_client = None
+paypal_client = None
+PAYPAL_CREATE_LEASE_SECONDS = float(os.environ.get('PAYPAL_CREATE_LEASE_SECONDS', '30'))
+
+# Per-worker services, created in lifespan() once the database is reachable
+outbox: Optional[OutboxWorkerPool] = None
+idempotency: Optional[IdempotencyStore] = None
+catalog: Optional[CatalogCache] = None
+recommendations: Optional[RecommendationEngine] = None
+analytics: Optional[SalesRollups] = None
+image_cache: Optional[ImageCache] = None
+product_events: Optional[ProductEventHub] = None
+popularity: Optional[PopularityCounters] = None
+
+OUTBOX_DRAIN_SECONDS = float(os.environ.get('OUTBOX_DRAIN_SECONDS', '10'))
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '30'))
+RELATED_PRODUCTS_TOP_K = int(os.environ.get('RELATED_PRODUCTS_TOP_K', '10'))
+RELATED_PRODUCTS_POLL_SECONDS = float(os.environ.get('RELATED_PRODUCTS_POLL_SECONDS', '5'))
+
+# Resized product/category images, bounded on disk
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024
+IMAGE_CACHE_CONTROL = "public, max-age=2592000"  # 30 days
+# Only these origins (host or host:port) are fetched by the image proxy
+IMAGE_ORIGIN_HOSTS = [host.strip() for host in os.environ.get('IMAGE_ORIGIN_HOSTS', 'images.unsplash.com,images.pexels.com').split(',') if host.strip()]
+IMAGE_MAX_SOURCE_BYTES = int(os.environ.get('IMAGE_MAX_SOURCE_MB', '20')) * 1024 * 1024
+
+# Live stock/price stream
+PRODUCT_STREAM_BUFFER = int(os.environ.get('PRODUCT_STREAM_BUFFER', '256'))
+PRODUCT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('PRODUCT_STREAM_HEARTBEAT_SECONDS', '15'))
+PRODUCT_CHANGE_STREAM = os.environ.get('PRODUCT_CHANGE_STREAM', '').lower() in ('1', 'true', 'yes')
+
+# Product view/cart/wishlist counters; a crash loses at most one flush interval
+POPULARITY_FLUSH_SECONDS = float(os.environ.get('POPULARITY_FLUSH_SECONDS', '10'))
+POPULARITY_HALF_LIFE_HOURS = float(os.environ.get('POPULARITY_HALF_LIFE_HOURS', '72'))
+
+# Opt-in request profiling: send X-Profile-Token, or sample a fraction of all requests
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '1'))
+profiles = ProfileStore(capacity=int(os.environ.get('PROFILE_KEEP', '20')))
+
+# Carts untouched for this long are removed by a TTL index
+CART_RETENTION_DAYS = int(os.environ.get('CART_RETENTION_DAYS', '30'))
+
+WISHLIST_MAX_ITEMS = int(os.environ.get('WISHLIST_MAX_ITEMS', '200'))
+
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -92,17 +150,38 @@ class ProductCreate(BaseModel):
     featured: bool = False
     age_range: Optional[str] = None
 
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    category: Optional[str] = None
+    stock: Optional[int] = None
+    image: Optional[str] = None
+    featured: Optional[bool] = None
+    age_range: Optional[str] = None
+
 class CartItem(BaseModel):
     product_id: str
     quantity: int
+    price_cents: Optional[int] = None  # price when the line was last priced; None once the product is deleted
     product: Optional[Product] = None
 
+class CartPricing(BaseModel):
+    subtotal_cents: int = 0
+    item_count: int = 0
+    price_version: Optional[str] = None  # catalog price version the lines were priced against
+
 class Cart(BaseModel):
     model_config = ConfigDict(extra="ignore")
     user_id: str
     items: List[CartItem] = []
+    pricing: CartPricing = CartPricing()
     updated_at: datetime
 
+class CartSummary(BaseModel):
+    count: int = 0
+    subtotal: float = 0.0
+
 class CartItemAdd(BaseModel):
     product_id: str
     quantity: int = 1
@@ -122,13 +201,23 @@ class OrderItem(BaseModel):
     price: float
     quantity: int
 
+# Allowed order status changes: pending -> paying -> paid -> shipped -> delivered.
+# A failed capture moves the order from paying back to pending.
+ORDER_TRANSITIONS = {
+    "pending": {"paying"},
+    "paying": {"paid", "pending"},
+    "paid": {"shipped"},
+    "shipped": {"delivered"},
+    "delivered": set(),
+}
+
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
     user_id: str
     items: List[OrderItem]
     total: float
-    status: str  # pending, paid, shipped, delivered
+    status: str  # see ORDER_TRANSITIONS
     payment_id: Optional[str] = None
     shipping_address: dict
     created_at: datetime
@@ -143,36 +232,60 @@ class Category(BaseModel):
     name: str
     image: str
 
+class Bootstrap(BaseModel):
+    user: Optional[User] = None
+    featured: List[Product]
+    categories: List[Category]
+    cart: CartSummary
+    wishlist_ids: List[str]
+
 # ============ AUTH HELPERS ============
 
+@lru_cache(maxsize=None)
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 def create_access_token(data: dict):
+    from jose import jwt
+    
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_user_id(token: str) -> str:
+    from jose import JWTError, jwt
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return user_id
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user_id = decode_user_id(credentials.credentials)
     
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     return User(**user)
 
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 # ============ AUTH ROUTES ============
 
 @api_router.post("/auth/register", response_model=Token)
@@ -226,18 +339,17 @@ async def get_me(current_user: User = Depends(get_current_user)):
 # ============ PRODUCT ROUTES ============
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, featured: Optional[bool] = None):
-    query = {}
+async def get_products(category: Optional[str] = None, featured: Optional[bool] = None, sort: Optional[str] = None):
+    products = await catalog.products()
     if category:
-        query["category"] = category
+        products = [product for product in products if product["category"] == category]
     if featured is not None:
-        query["featured"] = featured
-    
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
+        products = [product for product in products if product.get("featured") == featured]
+    if sort == "popular":
+        now = time.time()
+        products = sorted(products, key=lambda product: popularity.score(product, now), reverse=True)
+    elif sort is not None:
+        raise HTTPException(status_code=400, detail="sort must be 'popular'")
     
     return products
 
@@ -246,12 +358,23 @@ async def get_product(product_id: str):
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    popularity.record(product_id, "views")
     
     if isinstance(product.get('created_at'), str):
         product['created_at'] = datetime.fromisoformat(product['created_at'])
     
     return Product(**product)
 
+@api_router.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(product_id: str, limit: int = 4):
+    # Served entirely from memory: the top-K index and the catalog cache
+    related = []
+    for related_id, _ in recommendations.related(product_id, min(limit, RELATED_PRODUCTS_TOP_K)):
+        product = await catalog.get(related_id)
+        if product:
+            related.append(product)
+    return related
+
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, current_user: User = Depends(get_current_user)):
     product_id = str(uuid.uuid4())
@@ -262,30 +385,101 @@ async def create_product(product_data: ProductCreate, current_user: User = Depen
     }
     
     await db.products.insert_one(product_doc)
+    catalog.invalidate()
+    product_events.publish(product_doc)
     product_doc['created_at'] = datetime.fromisoformat(product_doc['created_at'])
     
     return Product(**product_doc)
 
+@api_router.patch("/products/{product_id}", response_model=Product)
+async def update_product(product_id: str, product_data: ProductUpdate, current_user: User = Depends(get_admin_user)):
+    changes = product_data.model_dump(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    
+    product = await db.products.find_one_and_update(
+        {"id": product_id},
+        {"$set": changes},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    catalog.invalidate()
+    if not changes.keys().isdisjoint(DELTA_FIELDS):
+        product_events.publish(product)
+    
+    if isinstance(product.get('created_at'), str):
+        product['created_at'] = datetime.fromisoformat(product['created_at'])
+    
+    return Product(**product)
+
 # ============ CART ROUTES ============
 
+def cart_pricing_stage(price_version: str) -> dict:
+    # Last stage of every cart update pipeline, so the summary always matches the lines it was computed from
+    return {"$set": {"pricing": {
+        # Lines without a price belong to products that were deleted; they stay visible but don't count
+        "subtotal_cents": {"$sum": {"$map": {"input": "$items", "in": {"$multiply": ["$$this.price_cents", "$$this.quantity"]}}}},
+        "item_count": {"$sum": {"$map": {"input": "$items", "in": {"$cond": [
+            {"$eq": [{"$ifNull": ["$$this.price_cents", None]}, None]}, 0, "$$this.quantity"
+        ]}}}},
+        # A cart keeps the version its older lines were priced at until a read reprices it
+        "price_version": {"$ifNull": ["$pricing.price_version", price_version]},
+    }}}
+
+async def update_cart(user_id: str, items_expression: dict, upsert: bool = False):
+    await db.carts.update_one(
+        {"user_id": user_id},
+        [
+            {"$set": {"items": items_expression, "updated_at": datetime.now(timezone.utc)}},
+            cart_pricing_stage(await catalog.price_version()),
+        ],
+        upsert=upsert
+    )
+
+async def load_priced_cart(user_id: str) -> Optional[dict]:
+    """The user's cart with pricing checked against the current catalog price version."""
+    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+    if not cart:
+        return None
+    
+    price_version = await catalog.price_version()
+    items = cart.get("items", [])
+    if cart.get("pricing", {}).get("price_version") == price_version and all("price_cents" in item for item in items):
+        return cart
+    
+    # Some price changed since this cart was priced; snapshot every line again
+    repriced = []
+    for item in items:
+        product = await catalog.get(item["product_id"])
+        # A deleted product keeps its line so the shopper sees it went away, but it is no longer priced
+        price_cents = to_cents(product["price"]) if product else None
+        repriced.append({"product_id": item["product_id"], "quantity": item["quantity"], "price_cents": price_cents})
+    priced = [item for item in repriced if item["price_cents"] is not None]
+    pricing = {
+        "subtotal_cents": sum(item["price_cents"] * item["quantity"] for item in priced),
+        "item_count": sum(item["quantity"] for item in priced),
+        "price_version": price_version,
+    }
+    # Skipped if a mutation landed since the read; the next read reprices again
+    await db.carts.update_one({"user_id": user_id, "items": items}, {"$set": {"items": repriced, "pricing": pricing}})
+    return {**cart, "items": repriced, "pricing": pricing}
+
+async def cart_summary(user_id: str) -> CartSummary:
+    cart = await load_priced_cart(user_id)
+    pricing = cart["pricing"] if cart else {}
+    return CartSummary(count=pricing.get("item_count", 0), subtotal=pricing.get("subtotal_cents", 0) / 100)
+
 @api_router.get("/cart", response_model=Cart)
 async def get_cart(current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
+    # Carts are created by the first add, not by viewing
+    cart = await load_priced_cart(current_user.id) or {"user_id": current_user.id, "items": [], "updated_at": datetime.now(timezone.utc)}
     
-    if not cart:
-        cart = {
-            "user_id": current_user.id,
-            "items": [],
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.carts.insert_one(cart)
-    
-    # Populate product details
+    # Product details come from the in-memory catalog; prices come from the cart
     for item in cart.get("items", []):
-        product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
+        product = await catalog.get(item["product_id"])
         if product:
-            if isinstance(product.get('created_at'), str):
-                product['created_at'] = datetime.fromisoformat(product['created_at'])
             item["product"] = Product(**product)
     
     if isinstance(cart.get('updated_at'), str):
@@ -293,68 +487,66 @@ async def get_cart(current_user: User = Depends(get_current_user)):
     
     return Cart(**cart)
 
+@api_router.get("/cart/summary", response_model=CartSummary)
+async def get_cart_summary(current_user: User = Depends(get_current_user)):
+    return await cart_summary(current_user.id)
+
 @api_router.post("/cart")
 async def add_to_cart(item_data: CartItemAdd, current_user: User = Depends(get_current_user)):
+    if item_data.quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    
     # Check if product exists
-    product = await db.products.find_one({"id": item_data.product_id})
+    product = await db.products.find_one({"id": item_data.product_id}, {"_id": 0, "price": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    
-    if not cart:
-        cart = {
-            "user_id": current_user.id,
-            "items": [],
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.carts.insert_one(cart)
-    
-    # Check if item already in cart
-    item_found = False
-    for item in cart.get("items", []):
-        if item["product_id"] == item_data.product_id:
-            item["quantity"] += item_data.quantity
-            item_found = True
-            break
-    
-    if not item_found:
-        cart["items"] = cart.get("items", []) + [{"product_id": item_data.product_id, "quantity": item_data.quantity}]
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": cart["items"], "updated_at": datetime.now(timezone.utc).isoformat()}}
+    product_id = {"$literal": item_data.product_id}
+    price_cents = to_cents(product["price"])
+    await update_cart(
+        current_user.id,
+        {"$cond": [
+            {"$in": [product_id, {"$ifNull": ["$items.product_id", []]}]},
+            {"$map": {"input": "$items", "in": {"$cond": [
+                {"$eq": ["$$this.product_id", product_id]},
+                {"product_id": "$$this.product_id", "quantity": {"$add": ["$$this.quantity", item_data.quantity]}, "price_cents": price_cents},
+                "$$this"
+            ]}}},
+            {"$concatArrays": [
+                {"$ifNull": ["$items", []]},
+                [{"product_id": item_data.product_id, "quantity": item_data.quantity, "price_cents": price_cents}]
+            ]}
+        ]},
+        upsert=True
     )
+    popularity.record(item_data.product_id, "cart_adds")
     
     return {"message": "Item added to cart"}
 
 @api_router.delete("/cart/{product_id}")
 async def remove_from_cart(product_id: str, current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    
-    if cart:
-        cart["items"] = [item for item in cart.get("items", []) if item["product_id"] != product_id]
-        await db.carts.update_one(
-            {"user_id": current_user.id},
-            {"$set": {"items": cart["items"], "updated_at": datetime.now(timezone.utc).isoformat()}}
-        )
+    await update_cart(
+        current_user.id,
+        {"$filter": {"input": {"$ifNull": ["$items", []]}, "cond": {"$ne": ["$$this.product_id", {"$literal": product_id}]}}}
+    )
     
     return {"message": "Item removed from cart"}
 
 @api_router.put("/cart/{product_id}")
 async def update_cart_quantity(product_id: str, quantity: int, current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
+    if quantity < 0:
+        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+    if quantity == 0:
+        return await remove_from_cart(product_id, current_user)
     
-    if cart:
-        for item in cart.get("items", []):
-            if item["product_id"] == product_id:
-                item["quantity"] = quantity
-                break
-        
-        await db.carts.update_one(
-            {"user_id": current_user.id},
-            {"$set": {"items": cart["items"], "updated_at": datetime.now(timezone.utc).isoformat()}}
-        )
+    await update_cart(
+        current_user.id,
+        {"$map": {"input": {"$ifNull": ["$items", []]}, "in": {"$cond": [
+            {"$eq": ["$$this.product_id", {"$literal": product_id}]},
+            {"product_id": "$$this.product_id", "quantity": quantity, "price_cents": "$$this.price_cents"},
+            "$$this"
+        ]}}}
+    )
     
     return {"message": "Cart updated"}
 
@@ -362,11 +554,7 @@ async def update_cart_quantity(product_id: str, quantity: int, current_user: Use
 
 @api_router.get("/wishlist")
 async def get_wishlist(current_user: User = Depends(get_current_user)):
-    wishlist = await db.wishlists.find_one({"user_id": current_user.id}, {"_id": 0})
-    
-    if not wishlist:
-        wishlist = {"user_id": current_user.id, "items": []}
-        await db.wishlists.insert_one(wishlist)
+    wishlist = await db.wishlists.find_one({"user_id": current_user.id}, {"_id": 0}) or {"items": []}
     
     # Populate product details
     products = []
@@ -379,24 +567,33 @@ async def get_wishlist(current_user: User = Depends(get_current_user)):
     
     return {"user_id": current_user.id, "items": wishlist.get("items", []), "products": products}
 
+@api_router.get("/wishlist/ids")
+async def get_wishlist_ids(current_user: User = Depends(get_current_user)):
+    return {"ids": await get_wishlist_ids_for(current_user.id)}
+
 @api_router.post("/wishlist/{product_id}")
 async def add_to_wishlist(product_id: str, current_user: User = Depends(get_current_user)):
     # Check if product exists
-    product = await db.products.find_one({"id": product_id})
+    product = await db.products.find_one({"id": product_id}, {"_id": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    wishlist = await db.wishlists.find_one({"user_id": current_user.id})
-    
-    if not wishlist:
-        wishlist = {"user_id": current_user.id, "items": []}
-        await db.wishlists.insert_one(wishlist)
-    
-    if product_id not in wishlist.get("items", []):
-        await db.wishlists.update_one(
-            {"user_id": current_user.id},
-            {"$push": {"items": product_id}}
-        )
+    # Matches only while the item is already present or there is room for it. A full
+    # wishlist falls through to the upsert insert, which the unique user_id index rejects.
+    selector = {
+        "user_id": current_user.id,
+        "$or": [{"items": product_id}, {f"items.{WISHLIST_MAX_ITEMS - 1}": {"$exists": False}}]
+    }
+    try:
+        await db.wishlists.update_one(selector, {"$addToSet": {"items": product_id}}, upsert=True)
+    except DuplicateKeyError:
+        # Two first adds can both try to insert; the server won't retry that because of
+        # the $or, so retry once here. The loser now sees the document the winner created.
+        try:
+            await db.wishlists.update_one(selector, {"$addToSet": {"items": product_id}}, upsert=True)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail=f"Wishlist is limited to {WISHLIST_MAX_ITEMS} items")
+    popularity.record(product_id, "wishlist_adds")
     
     return {"message": "Item added to wishlist"}
 
@@ -411,9 +608,20 @@ async def remove_from_wishlist(product_id: str, current_user: User = Depends(get
 
 # ============ ORDER ROUTES ============
 
+async def transition_order(order_id: str, from_status: str, to_status: str, fields: Optional[dict] = None, event: Optional[dict] = None) -> bool:
+    """Conditionally move an order between states; returns False if another request got there first."""
+    if to_status not in ORDER_TRANSITIONS[from_status]:
+        raise ValueError(f"Invalid order transition {from_status} -> {to_status}")
+    
+    update = {"$set": {"status": to_status, **(fields or {})}}
+    if event is not None:
+        update["$push"] = {"outbox": event}
+    result = await db.orders.update_one({"id": order_id, "status": from_status}, update)
+    return result.modified_count == 1
+
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+    orders = await db.orders.find({"user_id": current_user.id}, {"_id": 0, "outbox": 0}).to_list(1000)
     
     for order in orders:
         if isinstance(order.get('created_at'), str):
@@ -423,27 +631,44 @@ async def get_orders(current_user: User = Depends(get_current_user)):
 
 @api_router.post("/orders", response_model=Order)
 async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
+    # Names and prices come from the database, never from the client
+    product_ids = [item.product_id for item in order_data.items]
+    products = {
+        product["id"]: product
+        async for product in db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "name": 1, "price": 1})
+    }
+    items = []
+    for item in order_data.items:
+        product = products.get(item.product_id)
+        if not product:
+            raise HTTPException(status_code=400, detail=f"Product {item.product_id} is no longer available")
+        if item.quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+        items.append({"product_id": product["id"], "name": product["name"], "price": product["price"], "quantity": item.quantity})
+    if not items:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    
     order_id = str(uuid.uuid4())
-    total = sum(item.price * item.quantity for item in order_data.items)
+    total = sum(to_cents(item["price"]) * item["quantity"] for item in items) / 100
     
     order_doc = {
         "id": order_id,
         "user_id": current_user.id,
-        "items": [item.model_dump() for item in order_data.items],
+        "items": items,
         "total": total,
         "status": "pending",
         "payment_id": None,
         "shipping_address": order_data.shipping_address,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "outbox": [new_event("order.created", {"order_id": order_id, "user_id": current_user.id})]
     }
     
+    # The order and its side-effect event are written in one operation
     await db.orders.insert_one(order_doc)
+    outbox.notify()
     
     # Clear cart after order
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    await db.carts.delete_one({"user_id": current_user.id})
     
     order_doc['created_at'] = datetime.fromisoformat(order_doc['created_at'])
     
@@ -451,61 +676,332 @@ async def create_order(order_data: OrderCreate, current_user: User = Depends(get
 
 # ============ PAYPAL ROUTES ============
 
+def _captured_amount(result) -> Optional[str]:
+    try:
+        return result.purchase_units[0].payments.captures[0].amount.value
+    except (AttributeError, IndexError, TypeError):
+        return None
+
 @api_router.post("/paypal/create-order")
-async def create_paypal_order(order_id: str, current_user: User = Depends(get_current_user)):
-    if not paypal_client:
+async def create_paypal_order(order_id: str, idempotency_key: Optional[str] = Header(None), current_user: User = Depends(get_current_user)):
+    if not get_paypal_client():
         raise HTTPException(status_code=503, detail="PayPal integration not configured")
     
-    # Get order
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
+    key = idempotency_key or order_id
+    try:
+        cached = await idempotency.begin(current_user.id, "paypal.create-order", key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if cached is not None:
+        return cached
     
-    request = OrdersCreateRequest()
-    request.prefer('return=representation')
-    request.request_body = {
-        "intent": "CAPTURE",
-        "purchase_units": [{
-            "reference_id": order_id,
-            "amount": {
-                "currency_code": "USD",
-                "value": f"{order['total']:.2f}"
+    try:
+        # Get order
+        order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0, "outbox": 0})
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order["status"] != "pending":
+            raise HTTPException(status_code=409, detail=f"Order is {order['status']}, not awaiting payment")
+        
+        # A PayPal order was already created for this order by an earlier request
+        if order.get("paypal_order_id"):
+            result = {"id": order["paypal_order_id"]}
+        else:
+            # Requests with different keys race here; a short lease lets only one create the PayPal order
+            now = datetime.now(timezone.utc)
+            claimed = await db.orders.update_one(
+                {
+                    "id": order_id,
+                    "status": "pending",
+                    "paypal_order_id": {"$exists": False},
+                    "$or": [{"paypal_creating_until": {"$exists": False}}, {"paypal_creating_until": {"$lte": now}}]
+                },
+                {"$set": {"paypal_creating_until": now + timedelta(seconds=PAYPAL_CREATE_LEASE_SECONDS)}}
+            )
+            if claimed.modified_count != 1:
+                raise HTTPException(status_code=409, detail="A PayPal order is already being created for this order")
+            
+            from paypalcheckoutsdk.orders import OrdersCreateRequest
+            
+            request = OrdersCreateRequest()
+            request.prefer('return=representation')
+            request.request_body = {
+                "intent": "CAPTURE",
+                "purchase_units": [{
+                    "reference_id": order_id,
+                    "amount": {
+                        "currency_code": "USD",
+                        "value": f"{order['total']:.2f}"
+                    }
+                }]
             }
-        }]
-    }
+            
+            try:
+                response = await run_in_threadpool(paypal_client.execute, request)
+            except Exception as e:
+                await db.orders.update_one({"id": order_id}, {"$unset": {"paypal_creating_until": ""}})
+                raise HTTPException(status_code=500, detail=f"PayPal error: {str(e)}")
+            
+            await db.orders.update_one(
+                {"id": order_id, "status": "pending"},
+                {"$set": {"paypal_order_id": response.result.id}, "$unset": {"paypal_creating_until": ""}}
+            )
+            result = {"id": response.result.id}
+    except BaseException:
+        await idempotency.release(current_user.id, "paypal.create-order", key)
+        raise
     
-    try:
-        response = paypal_client.execute(request)
-        return {"id": response.result.id}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PayPal error: {str(e)}")
+    await idempotency.complete(current_user.id, "paypal.create-order", key, result)
+    return result
 
 @api_router.post("/paypal/capture-order")
-async def capture_paypal_order(paypal_order_id: str, order_id: str, current_user: User = Depends(get_current_user)):
-    if not paypal_client:
+async def capture_paypal_order(paypal_order_id: str, order_id: str, idempotency_key: Optional[str] = Header(None), current_user: User = Depends(get_current_user)):
+    if not get_paypal_client():
         raise HTTPException(status_code=503, detail="PayPal integration not configured")
     
-    request = OrdersCaptureRequest(paypal_order_id)
+    key = idempotency_key or order_id
+    try:
+        cached = await idempotency.begin(current_user.id, "paypal.capture-order", key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if cached is not None:
+        return cached
     
+    result = {"status": "success", "payment_id": paypal_order_id}
     try:
-        response = paypal_client.execute(request)
+        order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0, "outbox": 0})
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order.get("paypal_order_id") and order["paypal_order_id"] != paypal_order_id:
+            raise HTTPException(status_code=400, detail="PayPal order does not belong to this order")
         
-        # Update order status
-        await db.orders.update_one(
-            {"id": order_id, "user_id": current_user.id},
-            {"$set": {"status": "paid", "payment_id": paypal_order_id}}
-        )
+        # Captured by an earlier request that used a different idempotency key
+        if order["status"] == "paid" and order.get("payment_id") == paypal_order_id:
+            await idempotency.complete(current_user.id, "paypal.capture-order", key, result)
+            return result
+        
+        # Only one request can move the order out of pending, so only one reaches PayPal
+        if not await transition_order(order_id, "pending", "paying"):
+            raise HTTPException(status_code=409, detail="Order is not awaiting payment")
+        
+        from paypalcheckoutsdk.orders import OrdersCaptureRequest, OrdersGetRequest
         
-        return {"status": "success", "payment_id": paypal_order_id}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PayPal error: {str(e)}")
+        try:
+            response = await run_in_threadpool(paypal_client.execute, OrdersCaptureRequest(paypal_order_id))
+        except Exception as e:
+            # A timeout can arrive after PayPal captured, so ask PayPal before handing the order back
+            logger.warning("PayPal capture of %s failed, checking its status: %s", paypal_order_id, e)
+            try:
+                response = await run_in_threadpool(paypal_client.execute, OrdersGetRequest(paypal_order_id))
+            except Exception:
+                # Money may have moved, so the order stays in paying for manual reconciliation
+                await db.orders.update_one(
+                    {"id": order_id, "status": "paying"},
+                    {"$set": {"payment_id": paypal_order_id, "payment_error": f"Capture outcome unknown: {e}"}}
+                )
+                raise HTTPException(status_code=502, detail="PayPal capture outcome unknown")
+            if response.result.status != "COMPLETED":
+                # PayPal confirms nothing was captured, so the payment can be retried
+                await transition_order(order_id, "paying", "pending")
+                raise HTTPException(status_code=502, detail="PayPal capture failed")
+        
+        captured = _captured_amount(response.result)
+        if response.result.status != "COMPLETED" or captured != f"{order['total']:.2f}":
+            # Money may have moved, so the order stays in paying for manual reconciliation
+            await db.orders.update_one(
+                {"id": order_id, "status": "paying"},
+                {"$set": {"payment_id": paypal_order_id, "payment_error": f"Capture {response.result.status} for {captured}, expected {order['total']:.2f}"}}
+            )
+            raise HTTPException(status_code=502, detail="PayPal capture did not match the order total")
+        
+        await transition_order(
+            order_id, "paying", "paid",
+            {"payment_id": paypal_order_id, "paid_at": datetime.now(timezone.utc).isoformat()},
+            new_event("order.paid", {"order_id": order_id, "user_id": current_user.id})
+        )
+        outbox.notify()
+    except BaseException:
+        await idempotency.release(current_user.id, "paypal.capture-order", key)
+        raise
+    
+    await idempotency.complete(current_user.id, "paypal.capture-order", key, result)
+    return result
 
 # ============ CATEGORY ROUTES ============
 
 @api_router.get("/categories", response_model=List[Category])
 async def get_categories():
-    categories = await db.categories.find({}, {"_id": 0}).to_list(100)
-    return categories
+    return await catalog.categories()
+
+# ============ BOOTSTRAP ROUTES ============
+
+async def get_wishlist_ids_for(user_id: str) -> List[str]:
+    wishlist = await db.wishlists.find_one({"user_id": user_id}, {"_id": 0, "items": 1})
+    return wishlist.get("items", []) if wishlist else []
+
+@api_router.get("/bootstrap", response_model=Bootstrap)
+async def bootstrap(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Everything the storefront needs on first paint, in one round trip."""
+    try:
+        user_id = decode_user_id(credentials.credentials) if credentials else None
+    except HTTPException:
+        # A stale token gets the anonymous payload; the client drops it when user is null
+        user_id = None
+    
+    async def featured():
+        return [product for product in await catalog.products() if product.get("featured")]
+    
+    async def nothing(default):
+        return default
+    
+    # The user, cart and wishlist lookups only need the id from the token, so they run alongside the catalog reads
+    user, featured_products, categories, cart, wishlist_ids = await asyncio.gather(
+        db.users.find_one({"id": user_id}, {"_id": 0}) if user_id else nothing(None),
+        featured(),
+        catalog.categories(),
+        cart_summary(user_id) if user_id else nothing(CartSummary()),
+        get_wishlist_ids_for(user_id) if user_id else nothing([]),
+    )
+    if user is None:
+        cart, wishlist_ids = CartSummary(), []
+    
+    return Bootstrap(
+        user=User(**user) if user else None,
+        featured=featured_products,
+        categories=categories,
+        cart=cart,
+        wishlist_ids=wishlist_ids,
+    )
+
+# ============ STREAM ROUTES ============
+
+@api_router.get("/stream/products")
+async def stream_products(ids: Optional[str] = None):
+    """Server-Sent Events with stock/price deltas, optionally limited to ?ids=a,b,c."""
+    async def events():
+        # Subscribed here rather than in the handler: a client gone before streaming starts never runs this generator
+        subscription = product_events.subscribe(ids.split(",") if ids else None)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                batch = await subscription.next_batch(PRODUCT_STREAM_HEARTBEAT_SECONDS)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+                for delta in batch:
+                    yield f"event: product\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            # StreamingResponse cancels the generator when the client disconnects
+            product_events.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============ IMAGE ROUTES ============
+
+async def serve_image(source_url: str, width: Optional[int], format: str):
+    if format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(IMAGE_FORMATS)}")
+    try:
+        path, media_type = await image_cache.get(source_url, width, format)
+    except ImageFetchError as e:
+        # Details stay in the log; echoing them would turn the proxy into a probe
+        logger.warning("Image proxy failed: %s", e)
+        raise HTTPException(status_code=502, detail="Image unavailable")
+    
+    # FileResponse hands the path to the server (pathsend) when it supports zero-copy sends
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": IMAGE_CACHE_CONTROL})
+
+@api_router.get("/images/categories/{category_id}")
+async def get_category_image(category_id: str, w: Optional[int] = None, format: str = "webp"):
+    category = next((category for category in await catalog.categories() if category["id"] == category_id), None)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return await serve_image(category["image"], w, format)
+
+@api_router.get("/images/{product_id}")
+async def get_product_image(product_id: str, w: Optional[int] = None, format: str = "webp"):
+    product = await catalog.get(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return await serve_image(product["image"], w, format)
+
+# ============ HEALTH ROUTES ============
+
+@api_router.get("/health")
+async def health():
+    if not startup_report["ready"]:
+        raise HTTPException(status_code=503, detail="Worker is not ready")
+    return startup_report
+
+# ============ ADMIN ROUTES ============
+
+@api_router.put("/admin/orders/{order_id}/status")
+async def update_order_status(order_id: str, status: str, current_user: User = Depends(get_admin_user)):
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0, "status": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    # Payment states are only reachable through the PayPal capture flow
+    if status in ("paying", "paid") or status not in ORDER_TRANSITIONS.get(order["status"], set()):
+        raise HTTPException(status_code=400, detail=f"Cannot move order from {order['status']} to {status}")
+    
+    if not await transition_order(order_id, order["status"], status, event=new_event(f"order.{status}", {"order_id": order_id})):
+        raise HTTPException(status_code=409, detail="Order status changed concurrently")
+    outbox.notify()
+    
+    return {"id": order_id, "status": status}
+
+@api_router.get("/admin/analytics/sales")
+async def get_sales_report(
+    start: datetime,
+    end: datetime,
+    granularity: str = "day",
+    dimension: str = "category",
+    stage: str = "paid",
+    series: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    if granularity not in GRANULARITIES or dimension not in DIMENSIONS or stage not in STAGES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {GRANULARITIES}, dimension one of {DIMENSIONS}, stage one of {STAGES}")
+    
+    rows = await analytics.query(start, end, granularity, dimension, stage, series)
+    return {"start": start, "end": end, "granularity": granularity, "dimension": dimension, "stage": stage, "rows": rows}
+
+@api_router.post("/admin/analytics/backfill", status_code=202)
+async def start_sales_backfill(current_user: User = Depends(get_admin_user)):
+    if not analytics.start_backfill():
+        raise HTTPException(status_code=409, detail="Backfill already running")
+    return analytics.backfill_status
+
+@api_router.get("/admin/analytics/backfill")
+async def get_sales_backfill(current_user: User = Depends(get_admin_user)):
+    return analytics.backfill_status
+
+@api_router.post("/admin/maintenance/compact")
+async def compact_storage(current_user: User = Depends(get_admin_user)):
+    return await compact_carts_and_wishlists(db, CART_RETENTION_DAYS)
+
+@api_router.get("/admin/outbox/metrics")
+async def get_outbox_metrics(current_user: User = Depends(get_admin_user)):
+    return {**outbox.metrics.snapshot(), "backlog": await outbox.backlog()}
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: User = Depends(get_admin_user)):
+    return {"recorded": profiles.recorded, "profiles": profiles.list()}
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, current_user: User = Depends(get_admin_user)):
+    speedscope = profiles.get(profile_id)
+    if speedscope is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=speedscope,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'}
+    )
 
 # ============ SEED DATA ============
 
@@ -627,25 +1123,142 @@ async def seed_data():
         }
     ]
     await db.products.insert_many(products)
+    catalog.invalidate()
     
     return {"message": "Database seeded successfully", "products": len(products), "categories": len(categories)}
 
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# ============ APPLICATION LIFECYCLE ============
+
+startup_report = {"ready": False, "pid": None, "cold_start_ms": None, "phases_ms": {}}
+
+def create_paypal_client():
+    if not (paypal_client_id and paypal_secret):
+        return None
+    from paypalcheckoutsdk.core import PayPalHttpClient, SandboxEnvironment
+    
+    environment = SandboxEnvironment(client_id=paypal_client_id, client_secret=paypal_secret)
+    return PayPalHttpClient(environment)
+
+def get_paypal_client():
+    global paypal_client
+    if paypal_client is None:
+        paypal_client = create_paypal_client()
+    return paypal_client
+
+async def ensure_indexes():
+    await ensure_user_indexes(db)
+    await ensure_ttl_index(db.carts, "updated_at", CART_RETENTION_DAYS * 24 * 60 * 60)
+    await outbox.ensure_indexes()
+    await idempotency.ensure_indexes()
+    await analytics.ensure_indexes()
+    await recommendations.ensure_indexes()
+
+def register_outbox_handlers():
+    # Related products are not fed from here: an event reaches one worker, and every
+    # worker's index must see every order (RecommendationEngine polls for them instead)
+    async def on_order_created(event: dict):
+        await analytics.apply(event["payload"]["order_id"], "placed")
+    
+    async def on_order_paid(event: dict):
+        await analytics.apply(event["payload"]["order_id"], "paid")
+    
+    outbox.register("order.created", on_order_created)
+    outbox.register("order.paid", on_order_paid)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, paypal_client, outbox, idempotency, catalog, recommendations, analytics, image_cache, product_events, popularity
+    phases = {"import": _import_ms}
+    
+    started = time.perf_counter()
+    client = AsyncIOMotorClient(mongo_url, minPoolSize=MONGO_MIN_POOL_SIZE, maxPoolSize=MONGO_MAX_POOL_SIZE)
+    db = client[os.environ['DB_NAME']]
+    await client.admin.command("ping")
+    phases["mongo"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    outbox = OutboxWorkerPool(
+        db.orders,
+        db.outbox_dead_letters,
+        workers=int(os.environ.get('OUTBOX_WORKERS', '4')),
+        max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8')),
+    )
+    idempotency = IdempotencyStore(
+        db.idempotency_keys,
+        ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60))),
+    )
+    catalog = CatalogCache(db, ttl_seconds=CATALOG_CACHE_TTL_SECONDS)
+    recommendations = RecommendationEngine(db.orders, top_k=RELATED_PRODUCTS_TOP_K)
+    analytics = SalesRollups(db, catalog)
+    image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_ORIGIN_HOSTS, IMAGE_MAX_SOURCE_BYTES)
+    product_events = ProductEventHub(max_buffer=PRODUCT_STREAM_BUFFER)
+    popularity = PopularityCounters(db.products, POPULARITY_FLUSH_SECONDS, POPULARITY_HALF_LIFE_HOURS)
+    paypal_client = None  # built by get_paypal_client() on the first payment request
+    register_outbox_handlers()
+    
+    started = time.perf_counter()
+    await ensure_indexes()
+    phases["indexes"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    started = time.perf_counter()
+    await catalog.refresh()
+    await asyncio.to_thread(image_cache.load)
+    phases["catalog"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    # Built from the full order history in the background, then kept current by polling
+    rebuild_task = asyncio.create_task(recommendations.run(RELATED_PRODUCTS_POLL_SECONDS))
+    # Without a change stream only writes made through this worker reach its subscribers
+    watch_task = asyncio.create_task(product_events.watch(db.products)) if PRODUCT_CHANGE_STREAM else None
+    
+    outbox.start()
+    popularity.start()
+    startup_report.update(
+        ready=True,
+        pid=os.getpid(),
+        cold_start_ms=round((time.perf_counter() - _import_started) * 1000, 1),
+        phases_ms=phases,
+    )
+    logger.info("Worker %s ready in %.0f ms %s", os.getpid(), startup_report["cold_start_ms"], phases)
+    
+    try:
+        yield
+    finally:
+        # Runs after the server stopped accepting connections and in-flight requests finished
+        startup_report["ready"] = False
+        rebuild_task.cancel()
+        if watch_task is not None:
+            watch_task.cancel()
+        await outbox.stop(timeout=OUTBOX_DRAIN_SECONDS)
+        await popularity.stop()
+        await image_cache.close()
+        client.close()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outermost, so the profile covers routing, validation and serialization
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profiles,
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        interval=PROFILE_INTERVAL_MS / 1000,
+    )
+    
+    return app
+
+app = create_app()
+_import_ms = round((time.perf_counter() - _import_started) * 1000, 1)
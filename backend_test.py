@@ -177,6 +177,21 @@ class KidsToysAPITester:
         
         return False
 
+    def test_bootstrap(self):
+        """Test the single-request storefront bootstrap"""
+        print("\n🚦 Testing Bootstrap...")
+        
+        result = self.run_test("Get Bootstrap", "GET", "bootstrap", 200)
+        if not result:
+            return False
+        
+        user = result.get('user')
+        if self.token and (not user or user.get('id') != self.user_id):
+            return False
+        
+        print(f"   Featured: {len(result.get('featured', []))}, categories: {len(result.get('categories', []))}, cart: {result.get('cart')}")
+        return 'wishlist_ids' in result
+    
     def test_cart_operations(self):
         """Test cart functionality"""
         print("\n🛒 Testing Cart Operations...")
@@ -207,6 +222,12 @@ class KidsToysAPITester:
             if cart_with_items and len(cart_with_items.get('items', [])) > 0:
                 print(f"   Cart has {len(cart_with_items['items'])} items")
                 
+                # Server-side pricing
+                summary = self.run_test("Get Cart Summary", "GET", "cart/summary", 200)
+                if not summary or summary.get('count') != 2 or abs(summary.get('subtotal', 0) - products[0]['price'] * 2) > 0.005:
+                    print(f"   Unexpected cart summary: {summary}")
+                    return False
+                
                 # Update quantity
                 update_result = self.run_test("Update Cart Quantity", "PUT", f"cart/{product_id}?quantity=3", 200)
                 
@@ -246,6 +267,11 @@ class KidsToysAPITester:
             if wishlist_with_items and len(wishlist_with_items.get('items', [])) > 0:
                 print(f"   Wishlist has {len(wishlist_with_items['items'])} items")
                 
+                # Membership ids
+                ids = self.run_test("Get Wishlist Ids", "GET", "wishlist/ids", 200)
+                if not ids or product_id not in ids.get('ids', []):
+                    return False
+                
                 # Remove from wishlist
                 remove_result = self.run_test("Remove from Wishlist", "DELETE", f"wishlist/{product_id}", 200)
                 
@@ -314,6 +340,7 @@ class KidsToysAPITester:
         auth_ok = self.test_auth_register()
         if auth_ok:
             self.test_auth_me()
+            self.test_bootstrap()
         
         # Test cart and wishlist (requires auth)
         if auth_ok:
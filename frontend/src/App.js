@@ -16,36 +16,35 @@ const API = `${BACKEND_URL}/api`;
 
 export const AuthContext = createContext();
 export const CartContext = createContext();
+export const BootstrapContext = createContext(null);
 
 function App() {
   const [user, setUser] = useState(null);
   const [cartCount, setCartCount] = useState(0);
+  const [bootstrap, setBootstrap] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     const token = localStorage.getItem('token');
     if (token) {
       axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
-      fetchUser();
-    } else {
-      setLoading(false);
     }
+    fetchBootstrap(token);
   }, []);
 
-  useEffect(() => {
-    if (user) {
-      fetchCartCount();
-    }
-  }, [user]);
-
-  const fetchUser = async () => {
+  // User, cart count, wishlist ids and the home page catalog in a single request
+  const fetchBootstrap = async (token) => {
     try {
-      const response = await axios.get(`${API}/auth/me`);
-      setUser(response.data);
+      const response = await axios.get(`${API}/bootstrap`);
+      setBootstrap(response.data);
+      setUser(response.data.user);
+      setCartCount(response.data.cart.count);
+      if (token && !response.data.user) {
+        localStorage.removeItem('token');
+        delete axios.defaults.headers.common['Authorization'];
+      }
     } catch (error) {
-      console.error('Failed to fetch user:', error);
-      localStorage.removeItem('token');
-      delete axios.defaults.headers.common['Authorization'];
+      console.error('Failed to fetch bootstrap:', error);
     } finally {
       setLoading(false);
     }
@@ -53,9 +52,8 @@ function App() {
 
   const fetchCartCount = async () => {
     try {
-      const response = await axios.get(`${API}/cart`);
-      const count = response.data.items.reduce((sum, item) => sum + item.quantity, 0);
-      setCartCount(count);
+      const response = await axios.get(`${API}/cart/summary`);
+      setCartCount(response.data.count);
     } catch (error) {
       console.error('Failed to fetch cart:', error);
     }
@@ -65,6 +63,7 @@ function App() {
     localStorage.setItem('token', token);
     axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
     setUser(userData);
+    fetchCartCount();
   };
 
   const logout = () => {
@@ -84,6 +83,7 @@ function App() {
 
   return (
     <AuthContext.Provider value={{ user, login, logout }}>
+      <BootstrapContext.Provider value={bootstrap}>
       <CartContext.Provider value={{ cartCount, setCartCount, fetchCartCount }}>
         <BrowserRouter>
           <div className="App">
@@ -101,6 +101,7 @@ function App() {
           </div>
         </BrowserRouter>
       </CartContext.Provider>
+      </BootstrapContext.Provider>
     </AuthContext.Provider>
   );
 }
@@ -59,7 +59,7 @@ const ProductCard = ({ product }) => {
         {/* Image */}
         <div className="relative aspect-square overflow-hidden rounded-2xl mb-4 bg-gray-100">
           <img
-            src={product.image}
+            src={`${API}/images/${product.id}?w=480`}
             alt={product.name}
             className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
             data-testid="product-image"
@@ -56,11 +56,10 @@ const CartPage = () => {
     }
   };
 
+  // Priced on the server; the same total the order will be charged
   const getTotal = () => {
-    if (!cart || !cart.items) return 0;
-    return cart.items.reduce((sum, item) => {
-      return sum + (item.product?.price || 0) * item.quantity;
-    }, 0);
+    if (!cart || !cart.pricing) return 0;
+    return cart.pricing.subtotal_cents / 100;
   };
 
   if (loading) {
@@ -106,7 +105,7 @@ const CartPage = () => {
                     <Link to={`/products/${item.product_id}`} className="flex-shrink-0">
                       <div className="w-24 h-24 rounded-2xl overflow-hidden bg-gray-100">
                         <img
-                          src={item.product?.image}
+                          src={`${API}/images/${item.product_id}?w=160`}
                           alt={item.product?.name}
                           className="w-full h-full object-cover"
                           data-testid="cart-item-image"
@@ -123,7 +122,7 @@ const CartPage = () => {
                       </Link>
                       <p className="text-[#718096] text-sm" data-testid="cart-item-category">{item.product?.category}</p>
                       <p className="text-primary font-bold mt-2" data-testid="cart-item-price">
-                        ${item.product?.price}
+                        {item.price_cents == null ? 'No longer available' : `$${(item.price_cents / 100).toFixed(2)}`}
                       </p>
                     </div>
 
@@ -44,11 +44,10 @@ const CheckoutPage = () => {
     }
   };
 
+  // Priced on the server; the same total the order will be charged
   const getTotal = () => {
-    if (!cart || !cart.items) return 0;
-    return cart.items.reduce((sum, item) => {
-      return sum + (item.product?.price || 0) * item.quantity;
-    }, 0);
+    if (!cart || !cart.pricing) return 0;
+    return cart.pricing.subtotal_cents / 100;
   };
 
   const handleInputChange = (e) => {
@@ -71,7 +70,8 @@ const CheckoutPage = () => {
 
     try {
       // Create order
-      const orderItems = cart.items.map(item => ({
+      // Lines for deleted products are shown in the cart but not ordered
+      const orderItems = cart.items.filter(item => item.product).map(item => ({
         product_id: item.product_id,
         name: item.product.name,
         price: item.product.price,
@@ -239,11 +239,11 @@ const CheckoutPage = () => {
                 <h2 className="text-2xl font-bold text-[#2D3748] font-outfit mb-6">Order Summary</h2>
                 
                 <div className="space-y-4 mb-6">
-                  {cart?.items.map((item) => (
+                  {cart?.items.filter((item) => item.price_cents != null).map((item) => (
                     <div key={item.product_id} className="flex items-center space-x-3" data-testid={`checkout-item-${item.product_id}`}>
                       <div className="w-16 h-16 rounded-xl overflow-hidden bg-gray-100 flex-shrink-0">
                         <img
-                          src={item.product?.image}
+                          src={`${API}/images/${item.product_id}?w=160`}
                           alt={item.product?.name}
                           className="w-full h-full object-cover"
                         />
@@ -252,7 +252,7 @@ const CheckoutPage = () => {
                         <p className="text-sm font-semibold text-[#2D3748] truncate">{item.product?.name}</p>
                         <p className="text-xs text-[#718096]">Qty: {item.quantity}</p>
                       </div>
-                      <p className="text-sm font-semibold text-primary">${(item.product?.price * item.quantity).toFixed(2)}</p>
+                      <p className="text-sm font-semibold text-primary">${(item.price_cents * item.quantity / 100).toFixed(2)}</p>
                     </div>
                   ))}
                 </div>
@@ -1,20 +1,25 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useContext } from 'react';
 import { Link } from 'react-router-dom';
 import Layout from '../components/Layout';
 import ProductCard from '../components/ProductCard';
 import axios from 'axios';
 import { ArrowRight, Sparkles } from 'lucide-react';
+import { BootstrapContext } from '../App';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
 const HomePage = () => {
-  const [featuredProducts, setFeaturedProducts] = useState([]);
-  const [categories, setCategories] = useState([]);
-  const [loading, setLoading] = useState(true);
+  const bootstrap = useContext(BootstrapContext);
+  const [featuredProducts, setFeaturedProducts] = useState(bootstrap ? bootstrap.featured : []);
+  const [categories, setCategories] = useState(bootstrap ? bootstrap.categories : []);
+  const [loading, setLoading] = useState(!bootstrap);
 
   useEffect(() => {
-    fetchData();
+    // The app shell already loaded these with /bootstrap unless that request failed
+    if (!bootstrap) {
+      fetchData();
+    }
   }, []);
 
   const fetchData = async () => {
@@ -115,7 +120,7 @@ const HomePage = () => {
                 <div className="bg-[#FAFAFA] rounded-3xl p-4 hover:shadow-lg transition-all duration-300 hover:-translate-y-2">
                   <div className="aspect-square rounded-2xl overflow-hidden mb-3 bg-white">
                     <img
-                      src={category.image}
+                      src={`${API}/images/categories/${category.id}?w=320`}
                       alt={category.name}
                       className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-300"
                     />
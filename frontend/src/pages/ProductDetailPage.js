@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Layout from '../components/Layout';
+import ProductCard from '../components/ProductCard';
 import axios from 'axios';
 import { ShoppingCart, Heart, ArrowLeft } from 'lucide-react';
 import { AuthContext, CartContext } from '../App';
@@ -15,12 +16,14 @@ const ProductDetailPage = () => {
   const { fetchCartCount } = useContext(CartContext);
   const navigate = useNavigate();
   const [product, setProduct] = useState(null);
+  const [relatedProducts, setRelatedProducts] = useState([]);
   const [quantity, setQuantity] = useState(1);
   const [loading, setLoading] = useState(true);
   const [isAddingToCart, setIsAddingToCart] = useState(false);
 
   useEffect(() => {
     fetchProduct();
+    fetchRelatedProducts();
   }, [id]);
 
   const fetchProduct = async () => {
@@ -36,6 +39,15 @@ const ProductDetailPage = () => {
     }
   };
 
+  const fetchRelatedProducts = async () => {
+    try {
+      const response = await axios.get(`${API}/products/${id}/related`);
+      setRelatedProducts(response.data);
+    } catch (error) {
+      console.error('Failed to fetch related products:', error);
+    }
+  };
+
   const handleAddToCart = async () => {
     if (!user) {
       navigate('/auth');
@@ -103,7 +115,7 @@ const ProductDetailPage = () => {
             <div className="bg-white rounded-3xl p-8 shadow-sm">
               <div className="aspect-square rounded-2xl overflow-hidden bg-gray-100">
                 <img
-                  src={product.image}
+                  src={`${API}/images/${product.id}?w=800`}
                   alt={product.name}
                   className="w-full h-full object-cover"
                   data-testid="product-detail-image"
@@ -198,6 +210,17 @@ const ProductDetailPage = () => {
               </div>
             </div>
           </div>
+
+          {relatedProducts.length > 0 && (
+            <div className="mt-16" data-testid="related-products">
+              <h2 className="text-3xl font-bold text-[#2D3748] font-outfit mb-8">Frequently Bought Together</h2>
+              <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-4 gap-8">
+                {relatedProducts.map((relatedProduct) => (
+                  <ProductCard key={relatedProduct.id} product={relatedProduct} />
+                ))}
+              </div>
+            </div>
+          )}
         </div>
       </div>
     </Layout>
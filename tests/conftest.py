@@ -0,0 +1,88 @@
+import os
+import sys
+from pathlib import Path
+
+import mongomock.aggregate
+import mongomock.collection
+import pytest
+from pymongo import ReturnDocument
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "kids_test")
+
+_find_one_and_update = mongomock.collection.Collection.find_one_and_update
+
+
+def _find_one_and_update_by_id(self, filter, update, projection=None, sort=None, upsert=False,
+                               return_document=ReturnDocument.BEFORE, **kwargs):
+    # mongomock re-runs the filter to find the AFTER document, so an update that makes the
+    # document stop matching (every claim does) returns None. Mongo returns the updated document.
+    before = _find_one_and_update(self, filter, update, projection={"_id": 1}, sort=sort, upsert=upsert,
+                                  return_document=ReturnDocument.BEFORE, **kwargs)
+    if before is None:
+        if upsert and return_document == ReturnDocument.AFTER:
+            return self.find_one(filter, projection)
+        return None
+    return self.find_one({"_id": before["_id"]}, projection)
+
+
+mongomock.collection.Collection.find_one_and_update = _find_one_and_update_by_id
+
+_handle_project_operator = mongomock.aggregate._Parser._handle_project_operator
+_parse = mongomock.aggregate._Parser.parse
+
+
+def _handle_project_operator_with_array_sum(self, operator, values):
+    # Mongo sums the elements of a single array-valued expression; mongomock treats it as one value
+    if operator in mongomock.aggregate._GROUPING_OPERATOR_MAP and isinstance(values, dict):
+        parsed = self.parse(values)
+        return mongomock.aggregate._GROUPING_OPERATOR_MAP[operator](parsed if isinstance(parsed, list) else [parsed])
+    return _handle_project_operator(self, operator, values)
+
+
+def _parse_with_literal(self, expression):
+    if isinstance(expression, dict) and list(expression) == ["$literal"]:
+        return expression["$literal"]
+    return _parse(self, expression)
+
+
+mongomock.aggregate._Parser._handle_project_operator = _handle_project_operator_with_array_sum
+mongomock.aggregate._Parser.parse = _parse_with_literal
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["kids_test"]
+
+
+@pytest.fixture
+async def api(monkeypatch, tmp_path):
+    """An httpx client for the app, running its lifespan against mongomock."""
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+
+    mongo = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda *args, **kwargs: mongo)
+    monkeypatch.setattr(server, "IMAGE_CACHE_DIR", tmp_path / "images")
+    monkeypatch.setattr(server, "ADMIN_EMAILS", {"admin@example.com"})
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/api/seed")
+            yield client
+
+
+async def register(client, email: str = "shopper@example.com") -> dict:
+    response = await client.post("/api/auth/register", json={"email": email, "name": "Test", "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
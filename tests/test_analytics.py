@@ -0,0 +1,116 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from analytics import SalesRollups
+
+pytestmark = pytest.mark.anyio
+
+PRODUCTS = {"lego": {"category": "Building Blocks"}, "kite": {"category": "Outdoor"}}
+
+
+class FakeCatalog:
+    async def get(self, product_id):
+        return PRODUCTS.get(product_id)
+
+
+def at(day, hour, minute=0):
+    return datetime(2026, 3, day, hour, minute, tzinfo=timezone.utc)
+
+
+async def place(db, order_id, created_at, items, status="pending", paid_at=None):
+    await db.orders.insert_one({
+        "id": order_id,
+        "status": status,
+        "created_at": created_at.isoformat(),
+        **({"paid_at": paid_at.isoformat()} if paid_at else {}),
+        "items": [{"product_id": product_id, "price": price, "quantity": quantity} for product_id, price, quantity in items],
+    })
+
+
+@pytest.fixture
+def rollups(db):
+    return SalesRollups(db, FakeCatalog(), batch_size=2)
+
+
+async def totals(rollups, granularity, dimension, stage="placed", series=False):
+    rows = await rollups.query(at(1, 0), at(31, 0), granularity, dimension, stage, series)
+    return {(row["key"], row["bucket"].hour) if series else row["key"]: (row["revenue"], row["units"], row["orders"]) for row in rows}
+
+
+async def test_claimed_orders_are_counted_once(db, rollups):
+    await place(db, "o1", at(2, 10, 15), [("lego", 20.0, 2), ("kite", 5.5, 1)])
+
+    assert await rollups.apply("o1", "placed") is True
+    assert await rollups.apply("o1", "placed") is False
+    # Not paid yet, so the paid stage can't be claimed
+    assert await rollups.apply("o1", "paid") is False
+    assert await rollups.backfill() == 0
+
+    assert await totals(rollups, "day", "all") == {"all": (45.5, 3, 1)}
+    assert await totals(rollups, "day", "category") == {"Building Blocks": (40.0, 2, 1), "Outdoor": (5.5, 1, 1)}
+
+
+async def test_failed_write_releases_the_claim_for_the_retry(db, rollups, monkeypatch):
+    await place(db, "o1", at(2, 10), [("lego", 20.0, 1)])
+    write = rollups._write
+    calls = []
+
+    async def flaky_write(increments):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("bulk write failed")
+        await write(increments)
+
+    monkeypatch.setattr(rollups, "_write", flaky_write)
+    with pytest.raises(RuntimeError):
+        await rollups.apply("o1", "placed")
+    assert (await db.orders.find_one({"id": "o1"}))["rollups"] == []
+
+    assert await rollups.apply("o1", "placed") is True
+    assert await totals(rollups, "day", "all") == {"all": (20.0, 1, 1)}
+
+
+async def test_failed_backfill_batch_releases_its_claims(db, rollups, monkeypatch):
+    for n in range(3):
+        await place(db, f"o{n}", at(2, 10), [("kite", 1.0, 1)])
+    write = rollups._write
+    calls = []
+
+    async def flaky_write(increments):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("bulk write failed")
+        await write(increments)
+
+    monkeypatch.setattr(rollups, "_write", flaky_write)
+    with pytest.raises(RuntimeError):
+        await rollups.backfill()
+    assert rollups.backfill_status["error"] == "bulk write failed"
+
+    assert await rollups.backfill() == 3
+    assert await totals(rollups, "day", "all") == {"all": (3.0, 3, 3)}
+
+
+async def test_orders_land_in_hour_and_day_buckets(db, rollups):
+    await place(db, "o1", at(2, 10, 5), [("lego", 10.0, 1)])
+    await place(db, "o2", at(2, 10, 55), [("lego", 10.0, 1)])
+    await place(db, "o3", at(2, 11, 0), [("kite", 2.0, 3)], status="paid", paid_at=at(3, 9, 30))
+    assert await rollups.backfill() == 4
+
+    assert await totals(rollups, "hour", "all", series=True) == {("all", 10): (20.0, 2, 2), ("all", 11): (6.0, 3, 1)}
+    assert await totals(rollups, "day", "all") == {"all": (26.0, 5, 3)}
+    # Paid revenue is bucketed by when it was paid
+    paid = await rollups.query(at(1, 0), at(31, 0), "day", "product", "paid", series=True)
+    assert [(row["key"], row["bucket"].day, row["revenue"]) for row in paid] == [("kite", 3, 6.0)]
+
+
+async def test_query_range_includes_start_and_excludes_end(db, rollups):
+    for n, day in enumerate((1, 2, 3)):
+        await place(db, f"o{n}", at(day, 0), [("lego", 1.0, 1)])
+    await rollups.backfill()
+
+    rows = await rollups.query(at(2, 0), at(3, 0), "day", "product", "placed", series=True)
+    assert [(row["key"], row["bucket"].day) for row in rows] == [("lego", 2)]
+    rows = await rollups.query(at(1, 0), at(3, 0), "hour", "category", "placed")
+    assert rows == [{"key": "Building Blocks", "revenue": 2.0, "units": 2, "orders": 2}]
@@ -0,0 +1,48 @@
+import pytest
+
+import server
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_quantity_zero_removes_the_line_and_negative_is_rejected(api):
+    headers = await register(api)
+    first, second = (await api.get("/api/products")).json()[:2]
+    for product in (first, second):
+        await api.post("/api/cart", json={"product_id": product["id"], "quantity": 2}, headers=headers)
+
+    response = await api.put(f"/api/cart/{first['id']}", params={"quantity": -3}, headers=headers)
+    assert response.status_code == 400
+    response = await api.post("/api/cart", json={"product_id": first["id"], "quantity": -1}, headers=headers)
+    assert response.status_code == 400
+
+    assert (await api.put(f"/api/cart/{first['id']}", params={"quantity": 0}, headers=headers)).status_code == 200
+    cart = (await api.get("/api/cart", headers=headers)).json()
+    assert [item["product_id"] for item in cart["items"]] == [second["id"]]
+    assert cart["pricing"]["item_count"] == 2
+    assert cart["pricing"]["subtotal_cents"] == 2 * round(second["price"] * 100)
+
+
+async def test_deleted_products_leave_the_subtotal(api):
+    headers = await register(api)
+    kept, deleted = (await api.get("/api/products")).json()[:2]
+    for product in (kept, deleted):
+        await api.post("/api/cart", json={"product_id": product["id"], "quantity": 1}, headers=headers)
+
+    await server.db.products.delete_one({"id": deleted["id"]})
+    server.catalog.invalidate()
+
+    cart = (await api.get("/api/cart", headers=headers)).json()
+    lines = {item["product_id"]: item for item in cart["items"]}
+    assert lines[deleted["id"]]["price_cents"] is None
+    assert cart["pricing"]["subtotal_cents"] == round(kept["price"] * 100)
+    assert cart["pricing"]["item_count"] == 1
+    assert (await api.get("/api/cart/summary", headers=headers)).json()["count"] == 1
+
+    # Later pipeline updates keep the unpriced line out of the totals
+    await api.put(f"/api/cart/{deleted['id']}", params={"quantity": 5}, headers=headers)
+    await api.put(f"/api/cart/{kept['id']}", params={"quantity": 3}, headers=headers)
+    cart = (await api.get("/api/cart", headers=headers)).json()
+    assert cart["pricing"]["subtotal_cents"] == 3 * round(kept["price"] * 100)
+    assert cart["pricing"]["item_count"] == 3
@@ -0,0 +1,135 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import images
+from images import ImageCache
+
+pytestmark = pytest.mark.anyio
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_eviction_bounds_the_shared_directory(tmp_path):
+    # Two workers, one directory: the bound applies to what is on disk, not to what each worker wrote
+    first, second = ImageCache(tmp_path, max_bytes=250), ImageCache(tmp_path, max_bytes=250)
+    first.load()
+    for name, seconds in (("a.webp", 600), ("b.webp", 500), ("c.webp", 400)):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        age(tmp_path / name, seconds)
+
+    second._evict()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b.webp", "c.webp"]
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) == 200
+
+
+def test_recently_touched_files_are_not_evicted(tmp_path):
+    cache = ImageCache(tmp_path, max_bytes=50)
+    cache.load()
+    (tmp_path / "old.webp").write_bytes(b"x" * 100)
+    age(tmp_path / "old.webp", images.EVICT_GRACE_SECONDS + 60)
+    (tmp_path / "new.webp").write_bytes(b"x" * 100)
+
+    # A hit refreshes the file, so one about to be served is never deleted under it
+    assert cache._hit(tmp_path / "old.webp")
+    cache._evict()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.webp", "old.webp"]
+
+
+async def test_file_evicted_by_another_worker_is_produced_again(tmp_path):
+    cache = ImageCache(tmp_path, max_bytes=10_000)
+    cache.load()
+    produced = []
+
+    async def produce():
+        produced.append(1)
+        Image.new("RGB", (4, 4)).save(tmp_path / "v.png")
+
+    path = await cache._file("v.png", produce)
+    assert await cache._file("v.png", produce) == path
+    assert len(produced) == 1
+
+    path.unlink()
+    assert (await cache._file("v.png", produce)).exists()
+    assert len(produced) == 2
+
+
+@pytest.fixture
+def origin(tmp_path):
+    """A local static file server standing in for the image origin."""
+    import functools
+    import threading
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    root = tmp_path / "origin"
+    (root / "folder").mkdir(parents=True)
+    Image.new("RGB", (1000, 500), "red").save(root / "toy.png")
+    (root / "huge.bin").write_bytes(b"x" * 5000)
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+async def test_fetches_and_resizes_from_allowed_origin(tmp_path, origin):
+    cache = ImageCache(tmp_path / "cache", max_bytes=10_000_000, allowed_hosts=[origin])
+    cache.load()
+    try:
+        path, media_type = await cache.get(f"http://{origin}/toy.png", 200, "webp")
+        assert media_type == "image/webp"
+        with Image.open(path) as image:
+            assert (image.format, image.size) == ("WEBP", (320, 160))
+    finally:
+        await cache.close()
+
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data/",
+    "http://127.0.0.1:27017/",
+    "file:///etc/passwd",
+    "ftp://images.unsplash.com/toy.png",
+])
+async def test_rejects_origins_outside_the_allowlist(tmp_path, url):
+    cache = ImageCache(tmp_path, max_bytes=10_000, allowed_hosts=["images.unsplash.com"])
+    with pytest.raises(images.ImageFetchError, match="not allowed"):
+        await cache.get(url, None, "webp")
+    assert cache._client is None
+
+
+async def test_refuses_redirects_and_oversized_sources(tmp_path, origin):
+    cache = ImageCache(tmp_path / "cache", max_bytes=10_000_000, allowed_hosts=[origin], max_source_bytes=1000)
+    cache.load()
+    try:
+        # The static server answers a directory without its trailing slash with a 301
+        with pytest.raises(images.ImageFetchError, match="redirect"):
+            await cache.get(f"http://{origin}/folder", None, "png")
+        with pytest.raises(images.ImageFetchError, match="larger than"):
+            await cache.get(f"http://{origin}/huge.bin", None, "png")
+    finally:
+        await cache.close()
+    assert not list((tmp_path / "cache").iterdir())
+
+
+async def test_decompression_bombs_are_rejected(tmp_path, origin, monkeypatch):
+    # Stand-in for a tiny PNG that declares billions of pixels
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    cache = ImageCache(tmp_path / "cache", max_bytes=10_000_000, allowed_hosts=[origin])
+    cache.load()
+    try:
+        with pytest.raises(images.ImageFetchError, match="Could not decode"):
+            await cache.get(f"http://{origin}/toy.png", 200, "webp")
+    finally:
+        await cache.close()
@@ -0,0 +1,96 @@
+from datetime import datetime, timezone, timedelta
+
+import bson
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from maintenance import compact_carts_and_wishlists, ensure_user_indexes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_duplicate_carts_and_wishlists_are_merged_before_unique_index(db):
+    older = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    newer = datetime(2026, 1, 2, tzinfo=timezone.utc)
+    await db.carts.insert_many([
+        {"user_id": "u1", "items": [{"product_id": "a", "quantity": 1, "price_cents": 100}], "updated_at": older},
+        {"user_id": "u1", "items": [{"product_id": "a", "quantity": 2}, {"product_id": "b", "quantity": 1}], "updated_at": newer},
+        {"user_id": "u2", "items": [{"product_id": "c", "quantity": 1}], "updated_at": older},
+    ])
+    await db.wishlists.insert_many([
+        {"user_id": "u1", "items": ["a", "b"]},
+        {"user_id": "u1", "items": ["b", "c"]},
+    ])
+
+    await ensure_user_indexes(db)
+
+    [cart] = await db.carts.find({"user_id": "u1"}, {"_id": 0}).to_list(None)
+    assert cart == {
+        "user_id": "u1",
+        "items": [{"product_id": "a", "quantity": 3}, {"product_id": "b", "quantity": 1}],
+        "updated_at": newer.replace(tzinfo=None),
+    }
+    assert await db.carts.count_documents({"user_id": "u2"}) == 1
+    [wishlist] = await db.wishlists.find({"user_id": "u1"}, {"_id": 0}).to_list(None)
+    assert wishlist["items"] == ["a", "b", "c"]
+
+    with pytest.raises(DuplicateKeyError):
+        await db.wishlists.insert_one({"user_id": "u1", "items": []})
+    # Idempotent once the index exists
+    await ensure_user_indexes(db)
+
+
+async def test_compaction_drops_stale_carts_and_dangling_items(db, monkeypatch):
+    now = datetime.now(timezone.utc)
+    recent = now.replace(microsecond=0) - timedelta(days=1)
+    await db.products.insert_many([{"id": "a"}, {"id": "b"}])
+    await db.carts.insert_many([
+        # Legacy ISO-string timestamps: past retention is deleted, the rest becomes a BSON date
+        {"user_id": "old", "items": [{"product_id": "a", "quantity": 1}], "updated_at": (now - timedelta(days=60)).isoformat()},
+        {"user_id": "legacy", "items": [{"product_id": "a", "quantity": 1}], "updated_at": recent.isoformat()},
+        {"user_id": "dangling", "items": [{"product_id": "a", "quantity": 1}, {"product_id": "gone", "quantity": 2}],
+         "pricing": {"subtotal_cents": 900, "item_count": 3, "price_version": "v1"}, "updated_at": now},
+        {"user_id": "all-gone", "items": [{"product_id": "gone", "quantity": 1}], "updated_at": now},
+        {"user_id": "empty", "items": [], "updated_at": now},
+        {"user_id": "racer", "items": [], "updated_at": now},
+    ])
+    await db.wishlists.insert_many([
+        {"user_id": "u1", "items": ["a", "gone", "also-gone"]},
+        {"user_id": "u2", "items": ["gone"]},
+    ])
+    wishlists_before = {doc["user_id"]: doc async for doc in db.wishlists.find({})}
+
+    # The racer adds an item after compaction read the cart but before it deletes it
+    racer_id = (await db.carts.find_one({"user_id": "racer"}))["_id"]
+    collection_class = type(db.carts)
+    delete_one = collection_class.delete_one
+
+    async def racing_delete_one(self, filter, *args, **kwargs):
+        if self.name == "carts" and filter.get("_id") == racer_id:
+            await self.update_one({"_id": racer_id}, {"$push": {"items": {"product_id": "b", "quantity": 1}}})
+        return await delete_one(self, filter, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "delete_one", racing_delete_one)
+    report = await compact_carts_and_wishlists(db, retention_days=30)
+
+    carts = {doc["user_id"]: doc async for doc in db.carts.find({}, {"_id": 0})}
+    assert sorted(carts) == ["dangling", "legacy", "racer"]
+    assert carts["legacy"]["updated_at"] == recent.replace(tzinfo=None)
+    assert carts["dangling"]["items"] == [{"product_id": "a", "quantity": 1}]
+    # The stale subtotal stays until the next read reprices the cart
+    assert carts["dangling"]["pricing"] == {"subtotal_cents": 900, "item_count": 3}
+    assert carts["racer"]["items"] == [{"product_id": "b", "quantity": 1}]
+
+    wishlists = {doc["user_id"]: doc async for doc in db.wishlists.find({})}
+    assert list(wishlists) == ["u1"]
+    assert wishlists["u1"]["items"] == ["a"]
+
+    assert {key: report["carts"][key] for key in ("deleted", "items_removed")} == {"deleted": 3, "items_removed": 2}
+    assert report["wishlists"] == {
+        "deleted": 1,
+        "items_removed": 3,
+        "bytes_reclaimed": len(bson.encode(wishlists_before["u2"]))
+        + len(bson.encode(wishlists_before["u1"])) - len(bson.encode(wishlists["u1"])),
+    }
+    assert report["bytes_reclaimed"] == report["carts"]["bytes_reclaimed"] + report["wishlists"]["bytes_reclaimed"]
+    assert report["carts"]["bytes_reclaimed"] > 0
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from outbox import OutboxWorkerPool, new_event
+
+pytestmark = pytest.mark.anyio
+
+
+def make_pool(db, **options):
+    return OutboxWorkerPool(db.orders, db.outbox_dead_letters, **options)
+
+
+async def insert_order(db, *events):
+    await db.orders.insert_one({"id": "order-1", "status": "pending", "outbox": list(events)})
+
+
+async def test_drain_delivers_and_removes_event(db):
+    pool = make_pool(db)
+    seen = []
+
+    @pool.handler("order.created")
+    async def on_created(event):
+        seen.append(event["payload"])
+
+    await insert_order(db, new_event("order.created", {"order_id": "order-1"}))
+    assert await pool.drain() == 1
+    assert seen == [{"order_id": "order-1"}]
+    assert (await db.orders.find_one({"id": "order-1"}))["outbox"] == []
+    assert pool.metrics.processed == 1
+
+
+async def test_claim_holds_lease_until_it_expires(db):
+    await insert_order(db, new_event("order.created", {}))
+
+    pool = make_pool(db, lease_seconds=30)
+    event = await pool._claim()
+    assert event["attempts"] == 1
+    assert await pool._claim() is None
+
+    # A worker that dies mid-event leaves the claim behind; once the lease lapses it is reclaimed
+    await db.orders.update_one({"id": "order-1"}, {"$set": {"outbox.0.locked_until": datetime.now(timezone.utc)}})
+    again = await pool._claim()
+    assert again["id"] == event["id"]
+    assert again["attempts"] == 2
+    assert again["claim"] != event["claim"]
+
+
+async def test_failure_is_retried_with_backoff(db):
+    pool = make_pool(db, backoff_base=60)
+
+    @pool.handler("order.created")
+    async def failing(event):
+        raise RuntimeError("boom")
+
+    await insert_order(db, new_event("order.created", {}))
+    started = datetime.now(timezone.utc)
+    # The retry is scheduled in the future, so drain stops after one attempt
+    assert await pool.drain() == 1
+
+    [event] = (await db.orders.find_one({"id": "order-1"}))["outbox"]
+    assert event["status"] == "pending"
+    assert event["attempts"] == 1
+    assert event["last_error"] == "boom"
+    delay = (event["next_attempt_at"].replace(tzinfo=timezone.utc) - started).total_seconds()
+    assert 29 <= delay <= 61
+    assert pool.metrics.retried == 1
+
+
+async def test_retry_succeeds_after_transient_failure(db):
+    pool = make_pool(db, backoff_base=0)
+    attempts = []
+
+    @pool.handler("order.created")
+    async def flaky(event):
+        attempts.append(event["attempts"])
+        if len(attempts) < 3:
+            raise RuntimeError("transient")
+
+    await insert_order(db, new_event("order.created", {}))
+    assert await pool.drain() == 3
+    assert attempts == [1, 2, 3]
+    assert (await db.orders.find_one({"id": "order-1"}))["outbox"] == []
+    assert await db.outbox_dead_letters.count_documents({}) == 0
+
+
+async def test_exhausted_event_is_dead_lettered(db):
+    pool = make_pool(db, max_attempts=3, backoff_base=0)
+
+    @pool.handler("order.created")
+    async def failing(event):
+        raise RuntimeError("permanent")
+
+    event = new_event("order.created", {"order_id": "order-1"})
+    await insert_order(db, event)
+    assert await pool.drain() == 3
+
+    assert (await db.orders.find_one({"id": "order-1"}))["outbox"] == []
+    dead = await db.outbox_dead_letters.find_one({"id": event["id"]})
+    assert dead["status"] == "dead"
+    assert dead["attempts"] == 3
+    assert dead["last_error"] == "permanent"
+    assert "claim" not in dead
+    assert pool.metrics.dead_lettered == 1
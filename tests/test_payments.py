@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+class FakePayPal:
+    """Stands in for PayPalHttpClient; execute() is slow so concurrent requests overlap."""
+
+    def __init__(self):
+        self.total = None
+        self.calls = {"OrdersCreateRequest": 0, "OrdersCaptureRequest": 0, "OrdersGetRequest": 0}
+        self.captured = False
+        # "before" fails the capture request outright, "after" times out once the money has moved
+        self.capture_fails = None
+        self.get_fails = False
+        self._lock = threading.Lock()
+
+    def execute(self, request):
+        time.sleep(0.1)
+        name = type(request).__name__
+        with self._lock:
+            self.calls[name] += 1
+        if name == "OrdersCreateRequest":
+            return SimpleNamespace(result=SimpleNamespace(id="PAYPAL-1"))
+        if name == "OrdersCaptureRequest":
+            if self.capture_fails == "before":
+                raise IOError("connection reset")
+            self.captured = True
+            if self.capture_fails == "after":
+                raise TimeoutError("read timed out")
+        elif self.get_fails:
+            raise IOError("connection reset")
+        if not self.captured:
+            return SimpleNamespace(result=SimpleNamespace(status="APPROVED", purchase_units=[]))
+        capture = SimpleNamespace(amount=SimpleNamespace(value=f"{self.total:.2f}"))
+        unit = SimpleNamespace(payments=SimpleNamespace(captures=[capture]))
+        return SimpleNamespace(result=SimpleNamespace(status="COMPLETED", purchase_units=[unit]))
+
+
+@pytest.fixture
+def paypal(monkeypatch):
+    fake = FakePayPal()
+    monkeypatch.setattr(server, "create_paypal_client", lambda: fake)
+    return fake
+
+
+async def place_order(api, headers, paypal) -> dict:
+    product = (await api.get("/api/products")).json()[0]
+    item = {"product_id": product["id"], "name": product["name"], "price": product["price"], "quantity": 2}
+    order = (await api.post("/api/orders", json={"items": [item], "shipping_address": {}}, headers=headers)).json()
+    paypal.total = order["total"]
+    return order
+
+
+async def test_concurrent_captures_reach_paypal_exactly_once(api, paypal):
+    headers = await register(api)
+    order = await place_order(api, headers, paypal)
+    created = await api.post(f"/api/paypal/create-order?order_id={order['id']}", headers=headers)
+    assert created.json() == {"id": "PAYPAL-1"}
+
+    url = f"/api/paypal/capture-order?order_id={order['id']}&paypal_order_id=PAYPAL-1"
+    # Distinct keys get past the idempotency store and race on the pending -> paying
+    # transition; the shared key exercises the store's in-progress check
+    keys = [f"distinct-{i}" for i in range(10)] + ["shared"] * 10
+    responses = await asyncio.gather(*[api.post(url, headers={**headers, "Idempotency-Key": key}) for key in keys])
+
+    assert paypal.calls["OrdersCaptureRequest"] == 1
+    statuses = [response.status_code for response in responses]
+    assert set(statuses) <= {200, 409}
+    assert 200 in statuses
+
+    orders = (await api.get("/api/orders", headers=headers)).json()
+    assert orders[0]["status"] == "paid"
+    assert orders[0]["payment_id"] == "PAYPAL-1"
+
+    # Retries after the capture replay the result without calling PayPal again
+    retries = await asyncio.gather(*[api.post(url, headers={**headers, "Idempotency-Key": key}) for key in ("shared", "late")])
+    assert [response.status_code for response in retries] == [200, 200]
+    assert paypal.calls["OrdersCaptureRequest"] == 1
+
+
+async def test_concurrent_create_order_calls_paypal_once(api, paypal):
+    headers = await register(api)
+    order = await place_order(api, headers, paypal)
+
+    url = f"/api/paypal/create-order?order_id={order['id']}"
+    responses = await asyncio.gather(*[api.post(url, headers={**headers, "Idempotency-Key": f"k{i}"}) for i in range(5)])
+    assert paypal.calls["OrdersCreateRequest"] == 1
+    assert {response.status_code for response in responses} <= {200, 409}
+    assert {"id": "PAYPAL-1"} in [response.json() for response in responses if response.status_code == 200]
+
+    # Once created, any key gets the existing PayPal order back
+    again = await api.post(url, headers={**headers, "Idempotency-Key": "later"})
+    assert again.json() == {"id": "PAYPAL-1"}
+    assert paypal.calls["OrdersCreateRequest"] == 1
+
+
+async def capture(api, headers, order, key):
+    url = f"/api/paypal/capture-order?order_id={order['id']}&paypal_order_id=PAYPAL-1"
+    return await api.post(url, headers={**headers, "Idempotency-Key": key})
+
+
+async def order_status(api, headers) -> dict:
+    return (await api.get("/api/orders", headers=headers)).json()[0]
+
+
+async def test_capture_timeout_after_paypal_captured_marks_the_order_paid(api, paypal):
+    headers = await register(api)
+    order = await place_order(api, headers, paypal)
+    paypal.capture_fails = "after"
+
+    response = await capture(api, headers, order, "k1")
+    assert response.status_code == 200
+    assert paypal.calls["OrdersCaptureRequest"] == paypal.calls["OrdersGetRequest"] == 1
+    assert (await order_status(api, headers))["status"] == "paid"
+
+
+async def test_capture_paypal_did_not_take_returns_the_order_to_pending(api, paypal):
+    headers = await register(api)
+    order = await place_order(api, headers, paypal)
+    paypal.capture_fails = "before"
+
+    response = await capture(api, headers, order, "k1")
+    assert response.status_code == 502
+    assert "connection reset" not in response.text
+    assert (await order_status(api, headers))["status"] == "pending"
+
+    paypal.capture_fails = None
+    assert (await capture(api, headers, order, "k1")).status_code == 200
+    assert (await order_status(api, headers))["status"] == "paid"
+
+
+async def test_unknown_capture_outcome_holds_the_order_in_paying(api, paypal):
+    headers = await register(api)
+    order = await place_order(api, headers, paypal)
+    paypal.capture_fails, paypal.get_fails = "after", True
+
+    assert (await capture(api, headers, order, "k1")).status_code == 502
+    held = await server.db.orders.find_one({"id": order["id"]})
+    assert held["status"] == "paying"
+    assert held["payment_error"].startswith("Capture outcome unknown")
+
+    # Retries can't capture a second time while the order awaits reconciliation
+    assert (await capture(api, headers, order, "k2")).status_code == 409
+    assert paypal.calls["OrdersCaptureRequest"] == 1
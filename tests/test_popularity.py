@@ -0,0 +1,108 @@
+import pytest
+
+import server
+from popularity import LEGACY_EPOCH, PopularityCounters
+
+pytestmark = pytest.mark.anyio
+
+HOUR = 3600
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [LEGACY_EPOCH + 5 * 365 * 24 * HOUR]
+    monkeypatch.setattr("popularity.time.time", lambda: now[0])
+    return now
+
+
+async def seed(db, *ids):
+    await db.products.insert_many([{"id": product_id} for product_id in ids])
+
+
+async def test_flush_coalesces_counts_per_product(db, clock):
+    await seed(db, "a", "b")
+    counters = PopularityCounters(db.products, half_life_hours=6)
+    for kind in ("views", "views", "cart_adds", "wishlist_adds"):
+        counters.record("a", kind)
+    counters.record("b", "views")
+
+    assert await counters.flush() == 2
+    assert await counters.flush() == 0
+    a = await db.products.find_one({"id": "a"}, {"_id": 0})
+    assert (a["views"], a["cart_adds"], a["wishlist_adds"]) == (2, 1, 1)
+    assert a["popularity"] == pytest.approx(2 + 5 + 3)
+    assert a["popularity_at"] == clock[0]
+
+
+async def test_scores_decay_without_overflow(db, clock):
+    # Years past the epoch with a short half-life used to overflow the forward-decayed score
+    await seed(db, "a")
+    counters = PopularityCounters(db.products, half_life_hours=6)
+    counters.record("a", "cart_adds")
+    await counters.flush()
+
+    clock[0] += 6 * HOUR
+    counters.record("a", "views")
+    await counters.flush()
+    a = await db.products.find_one({"id": "a"})
+    assert a["popularity"] == pytest.approx(5 / 2 + 1)
+    assert counters.score(a, clock[0] + 12 * HOUR) == pytest.approx((5 / 2 + 1) / 4)
+    assert counters.score(a, clock[0] + 10_000 * 6 * HOUR) == 0
+
+
+async def test_legacy_scores_are_rebased_from_the_epoch(db, clock):
+    await db.products.insert_one({"id": "a", "popularity": 8.0})
+    counters = PopularityCounters(db.products, half_life_hours=72)
+    clock[0] = LEGACY_EPOCH + 3 * 72 * HOUR
+    assert counters.score(await db.products.find_one({"id": "a"})) == pytest.approx(1.0)
+
+    counters.record("a", "views")
+    await counters.flush()
+    a = await db.products.find_one({"id": "a"})
+    assert (a["popularity"], a["popularity_at"]) == (pytest.approx(2.0), clock[0])
+
+
+async def test_failed_flush_keeps_counts_for_the_next_one(db, clock, monkeypatch):
+    await seed(db, "a")
+    counters = PopularityCounters(db.products, half_life_hours=6)
+    counters.record("a", "views")
+
+    collection_class = type(db.products)
+    bulk_write = collection_class.bulk_write
+
+    async def failing_bulk_write(self, *args, **kwargs):
+        raise RuntimeError("primary stepped down")
+
+    monkeypatch.setattr(collection_class, "bulk_write", failing_bulk_write)
+    with pytest.raises(RuntimeError):
+        await counters.flush()
+    counters.record("a", "views")
+    monkeypatch.setattr(collection_class, "bulk_write", bulk_write)
+
+    assert await counters.flush() == 1
+    a = await db.products.find_one({"id": "a"})
+    assert (a["views"], a["popularity"]) == (2, pytest.approx(2))
+    assert counters.flushed == 1
+
+
+def test_half_life_must_be_positive(db):
+    with pytest.raises(ValueError, match="half_life_hours"):
+        PopularityCounters(db.products, half_life_hours=0)
+
+
+async def test_sort_popular_orders_by_decayed_score(api):
+    products = (await api.get("/api/products")).json()
+    old, recent = products[0]["id"], products[1]["id"]
+    # Much more popular once, but 30 half-lives ago
+    now = server.time.time()
+    await server.db.products.update_one({"id": old}, {"$set": {
+        "popularity": 1000.0, "popularity_at": now - 30 * server.POPULARITY_HALF_LIFE_HOURS * HOUR,
+    }})
+    for _ in range(2):
+        assert (await api.get(f"/api/products/{recent}")).status_code == 200
+    await server.popularity.flush()
+    server.catalog.invalidate()
+
+    ranked = [product["id"] for product in (await api.get("/api/products", params={"sort": "popular"})).json()]
+    assert ranked[0] == recent
+    assert ranked.index(old) == 1
@@ -0,0 +1,38 @@
+import pytest
+
+import server
+from product_stream import CHANGE_STREAM_PIPELINE
+
+pytestmark = pytest.mark.anyio
+
+
+def update(**fields):
+    return {"operationType": "update", "updateDescription": {"updatedFields": fields, "removedFields": []}}
+
+
+async def test_change_stream_skips_updates_without_stock_or_price(db):
+    events = {
+        "insert": {"operationType": "insert"},
+        "replace": {"operationType": "replace"},
+        "stock": update(stock=3),
+        "price": update(price=9.99, name="Renamed"),
+        "popularity": update(views=12, popularity=40.5),
+        "delete": {"operationType": "delete"},
+    }
+    await db.changes.insert_many([{"_id": name, **event} for name, event in events.items()])
+
+    matched = {doc["_id"] async for doc in db.changes.aggregate(CHANGE_STREAM_PIPELINE)}
+    assert matched == {"insert", "replace", "stock", "price"}
+
+
+async def test_stream_subscribes_only_while_it_is_iterated(api):
+    hub = server.product_events
+    response = await server.stream_products()
+    # A client that disconnects before the body starts must not leave a subscription behind
+    assert not hub._all
+
+    body = response.body_iterator
+    assert await body.__anext__() == "retry: 5000\n\n"
+    assert len(hub._all) == 1
+    await body.aclose()
+    assert not hub._all
@@ -0,0 +1,32 @@
+import pytest
+
+import server
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_only_admins_can_patch_products(api):
+    product = (await api.get("/api/products")).json()[0]
+
+    response = await api.patch(f"/api/products/{product['id']}", json={"stock": 0}, headers=await register(api))
+    assert response.status_code == 403
+    assert (await api.get(f"/api/products/{product['id']}")).json()["stock"] == product["stock"]
+
+    response = await api.patch(f"/api/products/{product['id']}", json={"stock": 0}, headers=await register(api, "admin@example.com"))
+    assert response.status_code == 200
+    assert response.json()["stock"] == 0
+
+
+async def test_patch_publishes_only_stock_and_price_changes(api):
+    product = (await api.get("/api/products")).json()[0]
+    admin = await register(api, "admin@example.com")
+    subscription = server.product_events.subscribe([product["id"]])
+    try:
+        await api.patch(f"/api/products/{product['id']}", json={"name": "Renamed"}, headers=admin)
+        assert await subscription.next_batch(0) == []
+
+        await api.patch(f"/api/products/{product['id']}", json={"price": 1.5}, headers=admin)
+        assert await subscription.next_batch(0) == [{"id": product["id"], "stock": product["stock"], "price": 1.5}]
+    finally:
+        server.product_events.unsubscribe(subscription)
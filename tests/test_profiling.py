@@ -0,0 +1,80 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from profiling import ProfileStore, ProfilingMiddleware
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+def summary(profile_id, duration_ms):
+    return {"id": profile_id, "duration_ms": duration_ms}
+
+
+def test_store_keeps_the_slowest_profiles():
+    store = ProfileStore(capacity=3)
+    for profile_id, duration_ms in [("a", 5), ("b", 50), ("c", 20), ("d", 1), ("e", 30)]:
+        store.add(summary(profile_id, duration_ms), f"speedscope-{profile_id}")
+
+    assert store.recorded == 5
+    assert [entry["id"] for entry in store.list()] == ["b", "e", "c"]
+    # Evicted profiles are gone, kept ones are served
+    assert store.get("a") is None and store.get("d") is None
+    assert store.get("e") == "speedscope-e"
+    assert not store.admits(20) and store.admits(21)
+
+
+def client_for(middleware_options, store):
+    async def hello(request):
+        return PlainTextResponse("hello")
+
+    app = ProfilingMiddleware(Starlette(routes=[Route("/hello", hello)]), store, **middleware_options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.parametrize("options, headers", [
+    ({"token": "secret"}, {"X-Profile-Token": "wrong"}),
+    ({"token": "secret"}, {}),
+    ({"sample_rate": 0.0}, {"X-Profile-Token": "secret"}),
+])
+async def test_middleware_leaves_unselected_requests_alone(options, headers):
+    store = ProfileStore()
+    async with client_for(options, store) as client:
+        response = await client.get("/hello", headers=headers)
+    assert response.text == "hello"
+    assert "x-profile-id" not in response.headers
+    assert store.recorded == 0
+
+
+async def test_valid_token_profiles_the_request():
+    store = ProfileStore()
+    async with client_for({"token": "secret"}, store) as client:
+        response = await client.get("/hello?x=1", headers={"X-Profile-Token": "secret"})
+    assert response.text == "hello"
+
+    profile_id = response.headers["x-profile-id"]
+    assert store.recorded == 1
+    [entry] = store.list()
+    assert (entry["id"], entry["path"], entry["query"], entry["status"]) == (profile_id, "/hello", "x=1", 200)
+    assert '"$schema"' in store.get(profile_id)
+
+
+async def test_sample_rate_one_profiles_every_request():
+    store = ProfileStore()
+    async with client_for({"sample_rate": 1.0}, store) as client:
+        response = await client.get("/hello")
+    assert "x-profile-id" in response.headers
+    assert store.recorded == 1
+
+
+async def test_profiles_are_admin_only(api):
+    assert (await api.get("/api/admin/profiles")).status_code == 403
+    assert (await api.get("/api/admin/profiles", headers=await register(api))).status_code == 403
+    assert (await api.get("/api/admin/profiles/missing", headers=await register(api, "other@example.com"))).status_code == 403
+
+    response = await api.get("/api/admin/profiles", headers=await register(api, "admin@example.com"))
+    assert response.status_code == 200
+    assert set(response.json()) == {"recorded", "profiles"}
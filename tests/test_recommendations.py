@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from recommendations import RecommendationEngine, RelatedProductsIndex
+
+pytestmark = pytest.mark.anyio
+
+
+def order(order_id, *product_ids, age_seconds=0):
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return {"id": order_id, "created_at": created_at.isoformat(), "items": [{"product_id": p} for p in product_ids]}
+
+
+def test_index_ranks_by_cooccurrence():
+    index = RelatedProductsIndex(top_k=2)
+    index.add_orders([["a", "b"], ["a", "b", "c"], ["a", "c"], ["a", "b"], ["d"]])
+    assert index.related("a") == [("b", 3.0), ("c", 2.0)]
+    assert index.related("d") == []
+    assert index.related("missing") == []
+
+
+async def test_every_worker_sees_new_orders_once(db):
+    await db.orders.insert_many([order("o1", "a", "b", age_seconds=3600), order("o2", "a", "b", age_seconds=5)])
+    # Two workers share the collection; neither relies on receiving an outbox event
+    workers = [RecommendationEngine(db.orders), RecommendationEngine(db.orders)]
+    for engine in workers:
+        await engine.rebuild()
+        assert engine.related("a") == [("b", 2.0)]
+
+    await db.orders.insert_one(order("o3", "a", "b", "c"))
+    for engine in workers:
+        assert await engine.catch_up() == 1
+        assert engine.related("a") == [("b", 3.0), ("c", 1.0)]
+        # Orders inside the overlap window are not counted twice
+        assert await engine.catch_up() == 0
+        assert engine.related("a") == [("b", 3.0), ("c", 1.0)]
+
+
+async def test_failed_rebuild_is_retried(db, monkeypatch):
+    await db.orders.insert_one(order("o1", "a", "b"))
+    engine = RecommendationEngine(db.orders)
+    rebuild = engine.rebuild
+    attempts = []
+
+    async def flaky_rebuild():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("database unavailable")
+        await rebuild()
+
+    monkeypatch.setattr(engine, "rebuild", flaky_rebuild)
+    task = asyncio.create_task(engine.run(poll_interval=60, retry_seconds=0))
+    for _ in range(100):
+        if engine.ready:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+    assert len(attempts) == 2
+    assert engine.related("a") == [("b", 1.0)]
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+from tests.conftest import BACKEND_DIR
+
+# Cold import of server.py, which runs on every worker start. It measured 500-850 ms here,
+# so the default leaves ~75% headroom for slower CI machines; raise it deliberately if a new
+# dependency is worth the cost
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "1500"))
+# Only needed by some requests, so they're imported on first use
+LAZY_MODULES = ("paypalcheckoutsdk", "passlib", "jose", "numpy", "scipy")
+
+
+def test_server_imports_within_budget_without_lazy_modules():
+    # A fresh interpreter, since the test session has already imported everything
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+    # Lines look like "import time: self [us] | cumulative | module", nested imports indented by two
+    cumulative, direct = {}, {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, total, module = line.split("|")
+            if total.strip().isdigit():
+                cumulative[module.strip()] = int(total)
+                if len(module) - len(module.lstrip()) == 3:
+                    direct[module.strip()] = int(total)
+
+    eager = sorted({name.split(".")[0] for name in cumulative} & set(LAZY_MODULES))
+    assert not eager, f"imported at start-up: {eager}"
+
+    import_ms = cumulative["server"] / 1000
+    slowest = sorted(((total, name) for name, total in direct.items()), reverse=True)[:5]
+    assert import_ms <= IMPORT_BUDGET_MS, (
+        f"server imported in {import_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms); slowest: "
+        + ", ".join(f"{name} {total / 1000:.0f} ms" for total, name in slowest)
+    )
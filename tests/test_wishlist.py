@@ -0,0 +1,29 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import server
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_first_wishlist_add_retries_lost_insert_race(api, monkeypatch):
+    headers = await register(api)
+    product = (await api.get("/api/products")).json()[0]
+
+    # Simulate the concurrent first add winning the insert just before ours
+    collection_class = type(server.db.wishlists)
+    update_one = collection_class.update_one
+    raced = []
+
+    async def racing_update_one(self, *args, **kwargs):
+        if self.name == "wishlists" and not raced:
+            raced.append(True)
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return await update_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "update_one", racing_update_one)
+    response = await api.post(f"/api/wishlist/{product['id']}", headers=headers)
+    assert raced
+    assert response.status_code == 200
+    assert (await api.get("/api/wishlist/ids", headers=headers)).json() == {"ids": [product["id"]]}